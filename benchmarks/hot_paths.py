@@ -0,0 +1,271 @@
+"""
+Throughput benchmarks for the model hot paths, over a matrix of grid sizes, walker
+counts and frame rates:
+
+- step:       `CitySimulation.step` / `BatchSimulation.step`, in ticks/sec and walker updates/sec
+              (updates of walkers still walking, arrived walkers cost nothing)
+- corner_xy:  `CityGrid.corner_xy` lookups/sec
+- statistics: end-to-end STATISTICS `run_simulation` runs/sec, per engine
+
+Every case does a fixed amount of work, so the numbers are comparable between commits,
+and reports the best of `--repeat` timings. Results are saved as JSON, and can be
+compared against a stored baseline with a regression gate:
+
+    python benchmarks/hot_paths.py --save baseline.json
+    python benchmarks/hot_paths.py --baseline baseline.json --max_regression 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.batch import BatchSimulation, WalkerBatch
+from src.config import Config, Engine, OutputMode
+from src.controller import run_simulation
+from src.model import CityGrid, CitySimulation, Walker, CORNERS, POLICIES
+
+GRID_SIZES = ((5, 6), (50, 50), (500, 500))
+WALKER_COUNTS = (1, 100, 10_000)
+FRAME_RATES = (60, 600)
+
+# Walker updates per timed repetition of a step case, and the bounds on its number of ticks
+# (a budget: the ticks of a repetition are spread over fresh populations, see `step_case`)
+STEP_UPDATES = {"tick": 100_000, "batch": 2_000_000}
+MIN_TICKS, MAX_TICKS = 20, 20_000
+
+
+# ------------------- Cases -------------------
+
+@lru_cache(maxsize=None)
+def _grid(num_streets: int, num_avenues: int) -> CityGrid:
+    return CityGrid(num_streets, num_avenues, 50.0, 20.0, 70.0, 40.0, (15.0, 20.0), traffic_light_grid_random_seed=0)
+
+
+def _walkers(grid: CityGrid, num_walkers: int) -> list[Walker]:
+    # Random trips, the same ones on every run
+    rng = random.Random(0)
+    return [
+        Walker(str(i), rng.randrange(grid.num_streets), rng.randrange(grid.num_avenues), rng.choice(CORNERS), 60.0,
+               (rng.randrange(grid.num_streets), rng.randrange(grid.num_avenues), rng.choice(CORNERS)),
+               rng.choice(POLICIES[:2]), grid)
+        for i in range(num_walkers)
+    ]
+
+
+@lru_cache(maxsize=None)
+def _active_walkers(size: tuple[int, int], num_walkers: int, frame_rate: int, max_ticks: int) -> tuple[int, ...]:
+    """Number of `_walkers` still walking at the start of every tick, until they have all arrived or max_ticks"""
+    grid = _grid(*size)
+    sim = CitySimulation(grid, _walkers(grid, num_walkers))
+    active = []
+    while sim.num_active and len(active) < max_ticks:
+        active.append(sim.num_active)
+        sim.step(1 / frame_rate, snapshot=False)
+    return tuple(active)
+
+
+def step_case(engine: str, size: tuple[int, int], num_walkers: int, frame_rate: int):
+    """
+    Returns (setup, metrics): `setup()` builds fresh simulations and returns the work to time.
+    The trips end long before the tick budget of small populations, so rather than timing
+    empty ticks, fresh copies of the population are stepped one after another, each until all
+    its walkers have arrived; only the updates of walkers still walking are counted.
+    """
+    ticks = min(max(STEP_UPDATES[engine] // num_walkers, MIN_TICKS), MAX_TICKS)
+    dt = 1 / frame_rate
+
+    def population() -> tuple[int, int, int]:
+        # (ticks and walker updates of one population, number of populations), from a dry run
+        active = _active_walkers(size, num_walkers, frame_rate, ticks)
+        population_ticks = max(len(active), 1)
+        return population_ticks, sum(active), -(-ticks // population_ticks)
+
+    def setup():
+        population_ticks, _, rounds = population()
+        grid = _grid(*size)
+        if engine == "tick":
+            sims = [CitySimulation(grid, _walkers(grid, num_walkers)) for _ in range(rounds)]
+
+            def work():
+                for sim in sims:
+                    for _ in range(population_ticks):
+                        sim.step(dt, snapshot=False)
+        else:
+            sims = [BatchSimulation(grid, WalkerBatch.from_walkers(grid, _walkers(grid, num_walkers))) for _ in range(rounds)]
+
+            def work():
+                for sim in sims:
+                    for _ in range(population_ticks):
+                        sim.step(dt)
+        return work
+
+    def metrics(seconds: float) -> dict:
+        population_ticks, population_updates, rounds = population()
+        return {"ticks_per_sec": rounds * population_ticks / seconds,
+                "walker_updates_per_sec": rounds * population_updates / seconds}
+
+    return setup, metrics
+
+
+def corner_xy_case(size: tuple[int, int], lookups: int = 200_000):
+    def setup():
+        grid = _grid(*size)
+        rng = random.Random(0)
+        queries = [(rng.randrange(grid.num_streets), rng.randrange(grid.num_avenues), rng.choice(CORNERS))
+                   for _ in range(lookups)]
+        corner_xy = grid.corner_xy
+
+        def work():
+            for street_idx, avenue_idx, corner in queries:
+                corner_xy(street_idx, avenue_idx, corner)
+        return work
+
+    return setup, lambda seconds: {"lookups_per_sec": lookups / seconds}
+
+
+def statistics_case(engine: str, size: tuple[int, int], frame_rate: int, runs: int = 1):
+    cfg = Config(output_mode=OutputMode.STATISTICS, engine=Engine(engine), frame_rate=frame_rate,
+                 num_streets=size[0], num_avenues=size[1], traffic_light_grid_random_seed=0)
+
+    def setup():
+        def work():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(runs):
+                    run_simulation(cfg)
+        return work
+
+    return setup, lambda seconds: {"runs_per_sec": runs / seconds}
+
+
+def build_cases(quick: bool) -> dict:
+    """case id -> (params, setup, metrics)"""
+    grid_sizes = GRID_SIZES[:2] if quick else GRID_SIZES
+    walker_counts = WALKER_COUNTS[:2] if quick else WALKER_COUNTS
+    frame_rates = FRAME_RATES[:1] if quick else FRAME_RATES
+
+    cases = {}
+    for engine in ("tick", "batch"):
+        for size in grid_sizes:
+            for num_walkers in walker_counts:
+                for frame_rate in frame_rates:
+                    params = {"kind": "step", "engine": engine, "grid": f"{size[0]}x{size[1]}",
+                              "walkers": num_walkers, "frame_rate": frame_rate}
+                    cases[f"step/{engine}/{size[0]}x{size[1]}/w{num_walkers}/fr{frame_rate}"] = (
+                        params, *step_case(engine, size, num_walkers, frame_rate)
+                    )
+    for size in grid_sizes:
+        cases[f"corner_xy/{size[0]}x{size[1]}"] = ({"kind": "corner_xy", "grid": f"{size[0]}x{size[1]}"}, *corner_xy_case(size))
+    # End-to-end runs walk corner to corner, so a 500x500 trip takes far too long to time here
+    for size, frame_rate in ((GRID_SIZES[0], 60), (GRID_SIZES[0], 600), (GRID_SIZES[1], 60)):
+        if quick and frame_rate not in frame_rates:
+            continue
+        for engine in Engine:
+            params = {"kind": "statistics", "engine": engine.value, "grid": f"{size[0]}x{size[1]}", "frame_rate": frame_rate}
+            cases[f"statistics/{engine.value}/{size[0]}x{size[1]}/fr{frame_rate}"] = (
+                params, *statistics_case(engine.value, size, frame_rate)
+            )
+    return cases
+
+
+# ------------------- Timing -------------------
+
+def time_case(setup, metrics, repeat: int) -> dict:
+    """Best throughput of `repeat` timed runs, each on a freshly set up case"""
+    best = None
+    for _ in range(repeat):
+        work = setup()
+        start = time.perf_counter()
+        work()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return metrics(best)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+# ------------------- Baseline comparison -------------------
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """
+    Prints every metric's change against the baseline.
+    :param max_regression: largest allowed throughput drop, in percent
+    :return: the regressed metrics, as "case id metric"
+    """
+    regressions = []
+    for case_id, result in results.items():
+        base = baseline.get(case_id)
+        if base is None:
+            print(f"{case_id:45s} new case, not in the baseline")
+            continue
+        for metric, value in result["metrics"].items():
+            base_value = base["metrics"].get(metric)
+            if not base_value:
+                continue
+            change = (value / base_value - 1) * 100
+            regressed = change < -max_regression
+            print(f"{case_id:45s} {metric:24s} {base_value:14.1f} -> {value:14.1f}  {change:+7.1f}%{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{case_id} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmarks for the model hot paths")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case, the best one counts")
+    parser.add_argument("--quick", action="store_true", help="Small grids, walker counts and frame rates only")
+    parser.add_argument("--filter", type=str, default=None, help="Only run the cases whose id contains this string")
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare against results saved with --save")
+    parser.add_argument("--max_regression", type=float, default=10.0,
+                        help="With --baseline, fail if any throughput drops by more than this percentage")
+    args = parser.parse_args()
+
+    cases = build_cases(args.quick)
+    if args.filter:
+        cases = {case_id: case for case_id, case in cases.items() if args.filter in case_id}
+
+    results = {}
+    for case_id, (params, setup, metrics) in cases.items():
+        results[case_id] = {"params": params, "metrics": time_case(setup, metrics, args.repeat)}
+        print(f"{case_id:45s} " + "  ".join(f"{metric} {value:,.1f}" for metric, value in results[case_id]["metrics"].items()))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f"\nAgainst {args.baseline} (commit {baseline['environment'].get('commit')}):")
+        regressions = compare(results, baseline["results"], args.max_regression)
+        if regressions:
+            sys.exit(f"{len(regressions)} metrics regressed by more than {args.max_regression}%: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
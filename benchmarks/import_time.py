@@ -0,0 +1,65 @@
+"""
+Startup-time benchmark for the headless simulation path.
+
+Starts fresh interpreters that import the controller and run a tiny STATISTICS
+simulation, the way a sweep worker does, and checks that neither pygame nor
+matplotlib got imported along the way.
+
+    python benchmarks/import_time.py --repeat 10 --budget 0.5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEADLESS_SNIPPET = """
+import contextlib, io, sys
+from src.config import Config, OutputMode, Engine
+from src.controller import run_simulation
+cfg = Config(output_mode=OutputMode.STATISTICS, engine=Engine.EVENT, traffic_light_grid_random_seed=1)
+with contextlib.redirect_stdout(io.StringIO()):
+    run_simulation(cfg)
+heavy = [m for m in ("pygame", "matplotlib") if m in sys.modules]
+if heavy:
+    sys.exit("headless path imported: " + ", ".join(heavy))
+"""
+
+
+def time_headless_start(repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", HEADLESS_SNIPPET], cwd=ROOT, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless startup-time benchmark")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of interpreter starts to time")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="Fail if the median start (seconds) is above this budget")
+    args = parser.parse_args()
+
+    # Warm up the filesystem cache and .pyc files before timing
+    time_headless_start(1)
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    baseline = time.perf_counter() - start
+
+    timings = time_headless_start(args.repeat)
+    median = statistics.median(timings)
+    print(f"bare interpreter:      {baseline * 1000:8.1f} ms")
+    print(f"headless run (median): {median * 1000:8.1f} ms  (min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms)")
+
+    if args.budget is not None and median > args.budget:
+        sys.exit(f"median headless start {median:.3f}s is over the {args.budget:.3f}s budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-from random import randint
+import argparse
+import sys
+from functools import partial
 
 from src.config import Config, OutputMode
-from src.controller import run_simulation
+from src.montecarlo import run_comparison
+from src.profiling import Profiler
+from src.sweep import expand_grid, run_sweep
 
 # Ranges
 # Experiment to grid search across parameters
@@ -12,33 +16,51 @@ street_crosswalk_lengths = (10, 30, 50)
 avenue_crosswalk_lengths = (10, 30, 50)
 
 avenue_traffic_light_cycle_times_tuples = [(10, 15), (25, 30), (50, 55)]
-num_random_trials = 5
-
-n = len(street_block_lengths) * len(avenue_block_lengths) * len(street_crosswalk_lengths) * len(
-    avenue_crosswalk_lengths) * len(avenue_traffic_light_cycle_times_tuples) * 2 * num_random_trials
-
-
-file_path = "experiment/both_biases_experiment.jsonl"
-print(f"Running {n} simulations")
-
-with open(file_path, "w+") as file:
-
-    for street_block_length in street_block_lengths:
-        for street_crosswalk_length in street_crosswalk_lengths:
-            for avenue_block_length in avenue_block_lengths:
-                for avenue_crosswalk_length in avenue_crosswalk_lengths:
-                    for time_pair in avenue_traffic_light_cycle_times_tuples:
-                        for _ in range(num_random_trials):
-                            for i in range(2):
-                                cfg = Config()
-                                cfg.output_mode = OutputMode.STATISTICS
-                                cfg.street_block_length = street_block_length
-                                cfg.avenue_block_length = avenue_block_length
-                                cfg.street_crosswalk_length = street_crosswalk_length
-                                cfg.avenue_crosswalk_length = avenue_crosswalk_length
-                                cfg.avenue_traffic_light_cycle_times = time_pair if i == 0 else time_pair[::-1]
-                                # Pick seed randomly, but log it out for repeatability
-                                cfg.traffic_light_grid_random_seed = randint(0, 100)
-
-                                file.write(run_simulation(cfg))
-                                file.write("\n")
+
+# Every config samples random cities (run ids 0, 1, ... of the sweep seed, each reproducible on
+# its own) until the confidence interval on the street - avenue difference is within +- tolerance
+# seconds, so the runs go to the configs where the policies are close
+sweep_seed = 0
+tolerance = 1.0
+max_runs = 1000
+
+parameter_grid = {
+    "street_block_length": street_block_lengths,
+    "street_crosswalk_length": street_crosswalk_lengths,
+    "avenue_block_length": avenue_block_lengths,
+    "avenue_crosswalk_length": avenue_crosswalk_lengths,
+    # both biases: each (green, red) pair and its reverse
+    "avenue_traffic_light_cycle_times": [
+        times for time_pair in avenue_traffic_light_cycle_times_tuples for times in (time_pair, time_pair[::-1])
+    ],
+}
+
+base_config = Config()
+base_config.output_mode = OutputMode.STATISTICS
+base_config.traffic_light_grid_random_seed = sweep_seed
+# Comparisons already run for any earlier sweep (eg. into another results directory) are reused
+base_config.cache_dir = "experiment/result_cache"
+
+# Columnar results dataset (see src/results.py), one directory per light cycle
+file_path = "experiment/both_biases_monte_carlo"
+partition_by = ("green_time", "red_time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Street vs avenue policy sweep")
+    parser.add_argument("--profile", action="store_true", help="Print the time spent in each phase, over all workers")
+    parser.add_argument("--profile_out", type=str, default=None,
+                        help="With --profile, also run cProfile in the workers and save the merged stats to this pstats file")
+    args = parser.parse_args()
+    profiler = Profiler(cprofile=args.profile_out is not None) if args.profile or args.profile_out else None
+
+    configs = list(expand_grid(base_config, parameter_grid))
+    print(f"Running {len(configs)} simulations")
+    written = run_sweep(configs, file_path, run=partial(run_comparison, tolerance=tolerance, max_runs=max_runs),
+                        partition_by=partition_by, profiler=profiler)
+    print(f"Wrote {written} new results to {file_path}")
+
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+        if args.profile_out:
+            profiler.dump_stats(args.profile_out)
@@ -1,10 +1,22 @@
+import os
+import sys
+from pathlib import Path
 
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.results import load_results
+
+RESULTS_PATH = "both_biases_monte_carlo"
+LEGACY_CSV_PATH = "both_biases_experiment.csv"
 
 
 def main():
-    df = pd.read_csv("both_biases_experiment.csv", index_col=0)
+    if os.path.isdir(RESULTS_PATH):
+        df = load_results(RESULTS_PATH)
+    else:
+        df = pd.read_csv(LEGACY_CSV_PATH, index_col=0)
     print(df[["street_policy", "avenue_policy", "green_time", "red_time"]].describe())
 
 
@@ -15,4 +27,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,85 @@
+"""
+Cross-checks the analytic travel-time solver against the simulation engines.
+
+- Against EventSimulation the arrival times must match exactly.
+- Against the tick engine they must agree to within the tick rounding: every move
+  can take up to one extra tick, so |tick - solver| <= moves * dt. Runs where a walker
+  reaches a light within that rounding of its switch can legitimately take another
+  route, so a small fraction of such runs is reported rather than failed.
+
+    python experiment/validate_solver.py --runs 200 --frame_rate 600
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.analytic import solve_travel_time
+from src.events import EventSimulation
+from src.model import CityGrid, CitySimulation, Walker, CORNERS, POLICIES
+
+
+def random_case(rng: random.Random):
+    grid = CityGrid(
+        num_streets=rng.randint(2, 8),
+        num_avenues=rng.randint(2, 8),
+        street_block_length=rng.choice((50.0, 200.0, 500.0)),
+        street_crosswalk_length=rng.choice((10.0, 20.0, 50.0)),
+        avenue_block_length=rng.choice((70.0, 200.0, 500.0)),
+        avenue_crosswalk_length=rng.choice((10.0, 40.0, 50.0)),
+        avenue_traffic_light_cycle_times=(rng.uniform(5, 60), rng.uniform(5, 60)),
+        traffic_light_grid_random_seed=rng.randint(1, 10_000),
+    )
+    start = (rng.randrange(grid.num_streets), rng.randrange(grid.num_avenues), rng.choice(CORNERS))
+    destination = (rng.randrange(grid.num_streets), rng.randrange(grid.num_avenues), rng.choice(CORNERS))
+    return grid, start, destination, rng.choice(POLICIES), rng.uniform(20.0, 80.0)
+
+
+def tick_arrival(grid, start, destination, policy, speed, frame_rate):
+    walker = Walker("0", start[0], start[1], start[2], speed, destination, policy, grid)
+    sim = CitySimulation(grid, [walker])
+    dt = 1 / frame_rate
+    while sim.num_active:
+        sim.step(dt, snapshot=False)
+    # Recorded at the start of the step the walker arrives in, like the costs of `run_simulation`
+    return sim.arrival_times["0"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-check the analytic solver against the engines")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--frame_rate", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dt = 1 / args.frame_rate
+    event_mismatches = 0
+    tick_mismatches = 0
+
+    for _ in range(args.runs):
+        grid, start, destination, policy, speed = random_case(rng)
+        solved = solve_travel_time(grid, start, destination, policy, speed)
+
+        walker = Walker("0", start[0], start[1], start[2], speed, destination, policy, grid)
+        event_sim = EventSimulation(grid, [walker])
+        event_sim.run()
+        event_arrival = event_sim.arrival_times["0"]
+        if event_arrival != solved.arrival_time:
+            event_mismatches += 1
+
+        moves = 2 * (abs(destination[0] - start[0]) + abs(destination[1] - start[1]) + 1)
+        tick = tick_arrival(grid, start, destination, policy, speed, args.frame_rate)
+        if abs(tick - solved.arrival_time) > moves * dt:
+            tick_mismatches += 1
+
+    print(f"{args.runs} runs: {event_mismatches} differ from the event engine, "
+          f"{tick_mismatches} differ from the tick engine by more than the tick rounding")
+    if event_mismatches or tick_mismatches > 0.02 * args.runs:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
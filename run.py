@@ -1,17 +1,43 @@
 import argparse
-from src.config import get_default_config, OutputMode, Config
-from src.controller import run_simulation
+import sys
+
+from src.config import get_default_config, OutputMode, Engine, Config
+from src.controller import replay_simulation, run_simulation
+from src.profiling import Profiler, profiling
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Chickenville Pedestrian Simulation")
     parser.add_argument("--mode", type=str, choices=[m.value for m in OutputMode],
                         default="pygame", help="Output mode: pygame | json | statistics | none")
+    parser.add_argument("--engine", type=str, choices=[e.value for e in Engine],
+                        default="tick", help="Simulation engine: tick | event | batch (event and batch are statistics mode only)")
     parser.add_argument("--time", type=float, default=None,
                         help="Maximum simulation time (seconds). None = unlimited.")
+    parser.add_argument("--wall_time", type=float, default=None,
+                        help="Maximum wall clock time (seconds) of a headless run. None = unlimited.")
+    parser.add_argument("--trajectory", type=str, default=None,
+                        help="json | none modes: record full walker trajectories to this binary file")
+    parser.add_argument("--telemetry", type=str, default=None,
+                        help="statistics mode: save per intersection wait heatmaps to this image, or the raw counters to a .npz file")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="statistics mode: reuse the results of identical runs stored in this directory")
+    parser.add_argument("--cache_max_bytes", type=int, default=1 << 30,
+                        help="With --cache_dir, trim the cache to this many bytes, least recently used first")
+    parser.add_argument("--replay", type=str, default=None,
+                        help="Play back a trajectory file recorded with --trajectory instead of simulating")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in each phase (model step, snapshot, drawing, output) to stderr")
+    parser.add_argument("--profile_out", type=str, default=None,
+                        help="With --profile, also run cProfile and save its stats to this pstats file")
     parser.add_argument("--screen_width", type=int, default=800, help="Screen width in pixels")
     parser.add_argument("--screen_height", type=int, default=600, help="Screen height in pixels")
-    parser.add_argument("--frame_rate", type=int, default=60, help="Frame rate")
+    parser.add_argument("--frame_rate", type=int, default=60, help="Model steps per simulated second")
+    parser.add_argument("--display_rate", type=int, default=60, help="pygame: frames drawn per real second")
+    parser.add_argument("--time_scale", type=float, default=1.0,
+                        help="pygame: simulated seconds per real second (ie. 60 watches an hour in a minute)")
+    parser.add_argument("--max_speed", action="store_true", help="pygame: run the model as fast as possible")
+    parser.add_argument("--render_every", type=int, default=1, help="pygame --max_speed: draw every Nth model step")
 
     parser.add_argument("--num_streets", type=int, default=5, help="Number of streets")
     parser.add_argument("--num_avenues", type=int, default=6, help="Number of avenues")
@@ -22,8 +48,11 @@ def parse_args():
 
     parser.add_argument("--traffic_cycle", type=str, default="15.0,20.0", help="Comma separated pair of floats denoting traffic cycle times (ie. '20.0,30.0' denotes 20s green and 30s red)")
     parser.add_argument("--random_seed", type=int, help="Random seed for controlling simulation")
+    parser.add_argument("--run_id", type=int, default=0, help="Run of the random seed to simulate (each run is a different city)")
 
     parser.add_argument("--walker_speed", type=float, default=60.0, help="Walker speed in m/s")
+    parser.add_argument("--demand_rate", type=float, default=None,
+                        help="statistics mode: spawn this many walkers per second between random corners until --time")
     parser.add_argument("--walker_starting_corner", type=str, default="sw", choices=["nw", "sw", "ne", "se"], help="Street corner that the walker starts at")
 
     return parser.parse_args()
@@ -36,6 +65,17 @@ def main():
     cfg.screen_width = args.screen_width
     cfg.screen_height = args.screen_height
     cfg.frame_rate = args.frame_rate
+    cfg.display_rate = args.display_rate
+    cfg.time_scale = args.time_scale
+    cfg.max_speed = args.max_speed
+    cfg.render_every = args.render_every
+    cfg.engine = Engine(args.engine)
+    cfg.trajectory_path = args.trajectory
+    cfg.max_sim_time = args.time
+    cfg.max_wall_time = args.wall_time
+    cfg.telemetry_path = args.telemetry
+    cfg.cache_dir = args.cache_dir
+    cfg.cache_max_bytes = args.cache_max_bytes
     cfg.num_streets = args.num_streets
     cfg.num_avenues = args.num_avenues
     cfg.street_block_length = args.street_block_length
@@ -44,10 +84,22 @@ def main():
     cfg.avenue_crosswalk_length = args.avenue_crosswalk_length
     cfg.avenue_traffic_light_cycle_times = (float(args.traffic_cycle.split(",")[0]), float(args.traffic_cycle.split(",")[1]))
     cfg.traffic_light_grid_random_seed = args.random_seed
+    cfg.run_id = args.run_id
     cfg.walker_speed = args.walker_speed
     cfg.walker_starting_corner = args.walker_starting_corner
+    cfg.demand_rate = args.demand_rate
+
+    profiler = Profiler(cprofile=args.profile_out is not None) if args.profile or args.profile_out else None
+    with profiling(profiler):
+        if args.replay:
+            replay_simulation(cfg, args.replay)
+        else:
+            run_simulation(cfg)
 
-    run_simulation(cfg)
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+        if args.profile_out:
+            profiler.dump_stats(args.profile_out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from src.batch import WalkerBatch
+from src.events import crosswalk_wait
+from src.files import replace_atomically
+from src.model import CityGrid, Walker, CORNER_CODES, POLICY_CODES
+
+
+# ------------------- Travel time solver -------------------
+
+@dataclass(frozen=True)
+class CornerWait:
+    street_idx: int
+    avenue_idx: int
+    corner: str
+    time: float   # simulation time the walker reached the corner
+    wait: float   # seconds spent waiting there for a green light
+
+
+@dataclass(frozen=True)
+class TravelTime:
+    departure_time: float
+    arrival_time: float
+    waits: Tuple[CornerWait, ...]
+
+    @property
+    def travel_time(self) -> float:
+        return self.arrival_time - self.departure_time
+
+    @property
+    def total_wait(self) -> float:
+        return sum(w.wait for w in self.waits)
+
+
+def solve_travel_time(grid: CityGrid,
+                      start: tuple[int, int, str],
+                      destination: tuple[int, int, str],
+                      policy: str,
+                      speed: float,
+                      departure_time: float = 0.0) -> TravelTime:
+    """
+    Computes when a single walker reaches its destination, straight from the light offsets.
+    The route is a chain of segments of `grid.segment_length / speed` seconds, plus a wait
+    at every crosswalk whose light is red, with the same decisions as `Walker`. This is
+    the dt -> 0 limit of the tick engine and matches `EventSimulation` exactly.
+    :param start: (street_idx, avenue_idx, corner) the walker leaves from
+    :param destination: (street_idx, avenue_idx, corner) the walker walks to
+    :param policy: "street" or "avenue"
+    :param speed: walker speed in m/s
+    :param departure_time: simulation time the walker leaves `start`
+    :return: arrival time and every wait along the way
+    """
+    walker = Walker("0", start[0], start[1], start[2], speed, destination, policy, grid, world_time=departure_time)
+
+    segment_time = grid.segment_length / speed
+    # every move gets closer to the destination, so this bounds the route length
+    max_moves = 2 * (grid.num_streets + grid.num_avenues + 2)
+
+    world_time = departure_time
+    waits = []
+    for _ in range(max_moves):
+        if (walker.target_corner_code == walker.corner_code
+                and walker.target_street_idx == walker.street_idx
+                and walker.target_avenue_idx == walker.avenue_idx):
+            # Walker stays put, so it has reached its destination
+            return TravelTime(departure_time=departure_time, arrival_time=world_time, waits=tuple(waits))
+
+        wait = crosswalk_wait(walker, world_time)
+        if wait > 0:
+            waits.append(CornerWait(walker.street_idx, walker.avenue_idx, walker.corner, world_time, wait))
+        world_time = world_time + wait + segment_time
+
+        walker.street_idx = walker.target_street_idx
+        walker.avenue_idx = walker.target_avenue_idx
+        walker.corner_code = walker.target_corner_code
+        walker._set_next_target(world_time=world_time)
+
+    raise Exception(f"Walker did not reach {destination} from {start} within {max_moves} moves")
+
+
+def solve_arrival_times(batch: WalkerBatch, departure_times) -> np.ndarray:
+    """
+    `solve_travel_time` for a whole `WalkerBatch` at once, every walker leaving its
+    current corner at its own departure time. Arrival times match `solve_travel_time`
+    exactly. The batch is walked to its destinations in the process.
+    :param batch: walkers whose targets were picked at `departure_times`, eg. by passing
+        them as `world_time` to `WalkerBatch`
+    :param departure_times: departure time of every walker, or one for all of them
+    :return: arrival time of every walker
+    """
+    grid = batch.grid
+    world_time = np.broadcast_to(np.asarray(departure_times, dtype=np.float64), len(batch)).copy()
+    segment_time = grid.segment_length / batch.speed
+    max_moves = 2 * (grid.num_streets + grid.num_avenues + 2)
+
+    for _ in range(max_moves):
+        same_intersection = (batch.target_street_idx == batch.street_idx) & (batch.target_avenue_idx == batch.avenue_idx)
+        moving = np.flatnonzero(~same_intersection | (batch.target_corner != batch.corner))
+        if not moving.size:
+            return world_time
+
+        # Same waits as `crosswalk_wait`
+        t = world_time[moving]
+        avenue_idx, street_idx = batch.avenue_idx[moving], batch.street_idx[moving]
+        avenue_light_is_green = grid.avenue_lights_are_green(t, avenue_idx, street_idx)
+        street_crosswalk = (batch.corner[moving] ^ batch.target_corner[moving]) & 2 != 0
+        blocked = same_intersection[moving] & np.where(street_crosswalk, avenue_light_is_green, ~avenue_light_is_green)
+        wait = np.where(blocked, grid.times_to_light_change(t, avenue_idx, street_idx), 0.0)
+        world_time[moving] = t + wait + segment_time[moving]
+
+        batch.street_idx[moving] = batch.target_street_idx[moving]
+        batch.avenue_idx[moving] = batch.target_avenue_idx[moving]
+        batch.corner[moving] = batch.target_corner[moving]
+        batch._set_next_target(moving, world_time[moving])
+
+    raise Exception(f"Walkers did not reach their destinations within {max_moves} moves")
+
+
+# ------------------- Travel time tables -------------------
+
+# Bump when the solver changes in a way that changes its results, to invalidate cached tables
+TABLE_VERSION = 1
+
+_TABLE_GRID_FIELDS = (
+    "num_streets", "num_avenues",
+    "street_block_length", "street_crosswalk_length",
+    "avenue_block_length", "avenue_crosswalk_length",
+    "avenue_traffic_light_cycle_times", "traffic_light_grid_random_seed", "run_id",
+)
+
+
+def _table_key(grid: CityGrid, policy: str, speed: float, origins, destinations, phases) -> str:
+    key = {
+        "version": TABLE_VERSION,
+        "grid": {field: getattr(grid, field) for field in _TABLE_GRID_FIELDS},
+        # Offsets can also come from a recording rather than the seed
+        "offsets": hashlib.sha256(np.ascontiguousarray(grid.traffic_light_offsets).tobytes()).hexdigest(),
+        "policy": policy,
+        "speed": speed,
+        "origins": [list(o) for o in origins],
+        "destinations": [list(d) for d in destinations],
+        "phases": phases.tolist(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def travel_time_table(grid: CityGrid,
+                      policy: str,
+                      origins: Sequence[tuple[int, int, str]],
+                      destinations: Sequence[tuple[int, int, str]],
+                      departure_times: Sequence[float],
+                      speed: float,
+                      cache_dir: str = None,
+                      chunk_size: int = 1 << 18) -> np.ndarray:
+    """
+    Travel times of a walker following `policy`, for every origin, destination and
+    departure time, see `CityGrid.travel_time_table`.
+    """
+    departure_times = np.asarray(departure_times, dtype=np.float64)
+    # Every light repeats every cycle, so a trip only depends on the departure time modulo the cycle
+    phases, phase_idx = np.unique(departure_times % grid.traffic_light_cycle_length, return_inverse=True)
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"{_table_key(grid, policy, speed, origins, destinations, phases)}.npy")
+        if os.path.exists(path):
+            return np.load(path)[:, :, phase_idx]
+
+    # One walker per (origin, destination, phase)
+    shape = (len(origins), len(destinations), len(phases))
+    origin, destination, phase = (idx.ravel() for idx in np.indices(shape))
+    origins = np.array([(o[0], o[1], CORNER_CODES[o[2]]) for o in origins], dtype=np.int64).reshape(-1, 3)
+    destinations = np.array([(d[0], d[1], CORNER_CODES[d[2]]) for d in destinations], dtype=np.int64).reshape(-1, 3)
+
+    table = np.empty(origin.size)
+    for start in range(0, origin.size, chunk_size):
+        rows = slice(start, start + chunk_size)
+        o, d, departure = origins[origin[rows]], destinations[destination[rows]], phases[phase[rows]]
+        batch = WalkerBatch(grid, o[:, 0], o[:, 1], o[:, 2], speed, d[:, 0], d[:, 1], d[:, 2],
+                            POLICY_CODES[policy], world_time=departure)
+        table[rows] = solve_arrival_times(batch, departure) - departure
+    table = table.reshape(shape)
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        replace_atomically(path, lambda tmp_path: _save_table(tmp_path, table))
+    return table[:, :, phase_idx]
+
+
+def _save_table(path: str, table: np.ndarray):
+    # Through a file object, as np.save would add ".npy" to a temporary file's name
+    with open(path, "wb") as file:
+        np.save(file, table)
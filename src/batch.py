@@ -0,0 +1,220 @@
+from typing import List
+
+import numpy as np
+
+from src.model import (CityGrid, Walker, AVENUE_CROSSWALK, CORNERS, CORNER_CODES, DIRECTIONS, STAY, STREET_CROSSWALK,
+                       _CORNER_DELTAS, stacked_policy_tables)
+from src.profiling import profiled
+
+# ------------------- Lookup tables -------------------
+
+# _CORNER_DELTAS as arrays indexed by [corner_code, direction_code]
+_MOVE_DJ = np.array([[_CORNER_DELTAS[c][d][0] for d in DIRECTIONS] for c in CORNERS], dtype=np.int32)
+_MOVE_DI = np.array([[_CORNER_DELTAS[c][d][1] for d in DIRECTIONS] for c in CORNERS], dtype=np.int32)
+_MOVE_CORNER = np.array([[CORNER_CODES[_CORNER_DELTAS[c][d][2]] for d in DIRECTIONS] for c in CORNERS], dtype=np.int8)
+
+
+def _axis(dest_idx, idx, dest_half, half, positive_half):
+    """+1 / -1 / 0 direction along one axis, see `Walker._set_next_target`"""
+    return np.where(
+        dest_idx != idx,
+        np.sign(dest_idx - idx),
+        np.where(dest_half == half, 0, np.where(dest_half == positive_half, 1, -1)),
+    )
+
+
+# ------------------- Walker batch -------------------
+
+class WalkerBatch:
+    """
+    Structure-of-arrays walker population. Every field of `Walker` is a NumPy array
+    with one entry per walker, so a whole population is stepped with array operations
+    instead of a Python loop. Semantics (light gating, policies, snapping) match `Walker`.
+    """
+    def __init__(self,
+                 grid: CityGrid,
+                 street_idx,
+                 avenue_idx,
+                 corner,
+                 speed,
+                 destination_street_idx,
+                 destination_avenue_idx,
+                 destination_corner,
+                 policy,
+                 world_time: float = 0.0,
+                 rng=None,
+                 target_street_idx=None,
+                 target_avenue_idx=None,
+                 target_corner=None,
+                 progress=0.0):
+        """
+        :param corner: corner codes (see `CORNER_CODES`)
+        :param destination_corner: corner codes of the destination corners
+        :param policy: policy codes (see `POLICY_CODES`)
+        :param rng: generator, SeedSequence or seed probabilistic policies draw from
+            (see `run_seed_sequence`), None for fresh OS entropy
+        :param target_street_idx: current targets of walkers that already made their decision,
+            together with target_avenue_idx, target_corner and progress; None to decide at world_time
+        Scalars are broadcast to the population size.
+        """
+        n = np.broadcast(street_idx, avenue_idx, corner, speed, destination_street_idx,
+                         destination_avenue_idx, destination_corner, policy).size
+        self.grid = grid
+        self.street_idx = np.broadcast_to(np.asarray(street_idx, dtype=np.int32), n).copy()
+        self.avenue_idx = np.broadcast_to(np.asarray(avenue_idx, dtype=np.int32), n).copy()
+        self.corner = np.broadcast_to(np.asarray(corner, dtype=np.int8), n).copy()
+        self.speed = np.broadcast_to(np.asarray(speed, dtype=np.float64), n).copy()
+        self.destination_street_idx = np.broadcast_to(np.asarray(destination_street_idx, dtype=np.int32), n).copy()
+        self.destination_avenue_idx = np.broadcast_to(np.asarray(destination_avenue_idx, dtype=np.int32), n).copy()
+        self.destination_corner = np.broadcast_to(np.asarray(destination_corner, dtype=np.int8), n).copy()
+        self.policy = np.broadcast_to(np.asarray(policy, dtype=np.int8), n).copy()
+        # only drawn from by probabilistic policies
+        self.rng = np.random.default_rng(rng)
+        self.progress = np.broadcast_to(np.asarray(progress, dtype=np.float64), n).copy()
+        if target_street_idx is not None:
+            self.target_street_idx = np.broadcast_to(np.asarray(target_street_idx, dtype=np.int32), n).copy()
+            self.target_avenue_idx = np.broadcast_to(np.asarray(target_avenue_idx, dtype=np.int32), n).copy()
+            self.target_corner = np.broadcast_to(np.asarray(target_corner, dtype=np.int8), n).copy()
+        else:
+            self.target_street_idx = self.street_idx.copy()
+            self.target_avenue_idx = self.avenue_idx.copy()
+            self.target_corner = self.corner.copy()
+            self._set_next_target(np.arange(n), world_time)
+
+    @classmethod
+    def from_walkers(cls, grid: CityGrid, walkers: List[Walker], rng=None) -> "WalkerBatch":
+        """Packs existing walkers (including their current target and progress) into a batch"""
+        return cls(
+            grid,
+            street_idx=[w.street_idx for w in walkers],
+            avenue_idx=[w.avenue_idx for w in walkers],
+            corner=[w.corner_code for w in walkers],
+            speed=[w.speed for w in walkers],
+            destination_street_idx=[w.destination_street_idx for w in walkers],
+            destination_avenue_idx=[w.destination_avenue_idx for w in walkers],
+            destination_corner=[w.destination_corner_code for w in walkers],
+            policy=[w.policy_code for w in walkers],
+            rng=rng,
+            target_street_idx=[w.target_street_idx for w in walkers],
+            target_avenue_idx=[w.target_avenue_idx for w in walkers],
+            target_corner=[w.target_corner_code for w in walkers],
+            progress=[w.progress for w in walkers],
+        )
+
+    def __len__(self):
+        return self.street_idx.size
+
+    def avenue_light_is_green(self, idx, world_time: float):
+        """Avenue light state at the current intersection of the walkers in `idx`"""
+        return self.grid.avenue_lights_are_green(world_time, self.avenue_idx[idx], self.street_idx[idx])
+
+    def positions(self) -> np.ndarray:
+        """(n, 2) array of walker (x, y) world coordinates"""
+        return self.grid.segment_xy(self.street_idx, self.avenue_idx, self.corner,
+                                    self.target_street_idx, self.target_avenue_idx, self.target_corner,
+                                    self.progress)
+
+    def arrived(self, idx=slice(None)):
+        """Boolean mask of the walkers in `idx` (by default all of them) standing on their destination corner"""
+        return ((self.street_idx[idx] == self.destination_street_idx[idx])
+                & (self.avenue_idx[idx] == self.destination_avenue_idx[idx])
+                & (self.corner[idx] == self.destination_corner[idx]))
+
+    def _set_next_target(self, idx, world_time: float):
+        corner = self.corner[idx]
+        dest_corner = self.destination_corner[idx]
+
+        # n_s_axis: +1 north, -1 south, 0 on the correct street side
+        n_s_axis = _axis(self.destination_street_idx[idx], self.street_idx[idx], dest_corner >> 1, corner >> 1, 0)
+        # e_w_axis: +1 east, -1 west, 0 on the correct avenue side
+        e_w_axis = _axis(self.destination_avenue_idx[idx], self.avenue_idx[idx], dest_corner & 1, corner & 1, 1)
+
+        # Look every walker's decision up in its policy's tables, see `Walker._set_next_target`
+        directions, cumulative, horizons, deterministic = stacked_policy_tables()
+        policy = self.policy[idx]
+        light_state = self.avenue_light_is_green(idx, world_time).astype(np.int8)
+        horizon = horizons[policy]
+        if horizon.any():
+            times_to_light_change = self.grid.times_to_light_change(world_time, self.avenue_idx[idx], self.street_idx[idx])
+            light_state |= (times_to_light_change < horizon).astype(np.int8) << 1
+        decision = (policy, corner, n_s_axis + 1, e_w_axis + 1, light_state)
+        direction = directions[decision]
+
+        if not deterministic.all():
+            # Probabilistic policies draw their direction from the cumulative probabilities
+            drawing = np.flatnonzero(~deterministic[policy] & (direction != STAY))
+            draw = self.rng.random(drawing.size)
+            direction[drawing] = (draw[:, None] >= cumulative[tuple(axis[drawing] for axis in decision)]).sum(axis=-1)
+
+        stay = direction == STAY
+        direction = np.where(stay, 0, direction)
+        self.target_street_idx[idx] = self.street_idx[idx] + np.where(stay, 0, _MOVE_DJ[corner, direction])
+        self.target_avenue_idx[idx] = self.avenue_idx[idx] + np.where(stay, 0, _MOVE_DI[corner, direction])
+        self.target_corner[idx] = np.where(stay, corner, _MOVE_CORNER[corner, direction])
+        self.progress[idx] = 0.0
+
+    def update(self, dt: float, world_time: float, telemetry=None) -> np.ndarray:
+        """
+        Moves every walker dt seconds along, up to world_time.
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` to record waits and crossings in
+        :return: indices of the walkers that reached their destination in this update
+        """
+        same_intersection = (self.target_street_idx == self.street_idx) & (self.target_avenue_idx == self.avenue_idx)
+        moving = ~same_intersection | (self.target_corner != self.corner)
+
+        # Walkers about to step onto a crosswalk wait for their light
+        crossing = np.flatnonzero(moving & same_intersection & (self.progress <= 0.0))
+        if crossing.size:
+            avenue_light_is_green = self.avenue_light_is_green(crossing, world_time)
+            # n/s (street) crosswalks need the avenue light red, e/w (avenue) crosswalks need it green
+            street_crosswalk = (self.corner[crossing] >> 1) != (self.target_corner[crossing] >> 1)
+            blocked = np.where(street_crosswalk, avenue_light_is_green, ~avenue_light_is_green)
+            moving[crossing[blocked]] = False
+            if telemetry is not None:
+                crosswalk = np.where(street_crosswalk, STREET_CROSSWALK, AVENUE_CROSSWALK)
+                telemetry.record_batch(self, crossing, crosswalk, blocked, dt)
+
+        moving = np.flatnonzero(moving)
+        self.progress[moving] += self.speed[moving] * dt / self.grid.segment_length
+
+        # Snap to target corner
+        snapped = moving[self.progress[moving] >= 1.0]
+        if snapped.size:
+            self.street_idx[snapped] = self.target_street_idx[snapped]
+            self.avenue_idx[snapped] = self.target_avenue_idx[snapped]
+            self.corner[snapped] = self.target_corner[snapped]
+            self._set_next_target(snapped, world_time)
+            # Policies only stay put at the destination
+            return snapped[self.arrived(snapped)]
+        return snapped
+
+
+# ------------------- Simulation -------------------
+
+class BatchSimulation:
+    """Counterpart to `CitySimulation` that steps a `WalkerBatch` with array operations"""
+    def __init__(self, grid: CityGrid, walkers: WalkerBatch, telemetry=None):
+        """
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` to record waits and crossings in
+        """
+        self.grid = grid
+        self.walkers = walkers
+        self.telemetry = telemetry
+        self.time: float = 0.0
+        # simulation time every walker arrived at its destination (NaN until it does), see `step`
+        arrived = walkers.arrived()
+        self.arrival_times = np.where(arrived, self.time, np.nan)
+        self.num_active = int(arrived.size - arrived.sum())
+
+    @profiled("model.step")
+    def step(self, dt: float):
+        """
+        Advances the simulation by dt seconds. Like `CitySimulation.step`, a walker that arrives
+        during the step is recorded in `arrival_times` at the time the step started.
+        """
+        start_time = self.time
+        self.time += dt
+        arrived = self.walkers.update(dt, self.time, self.telemetry)
+        if arrived.size:
+            self.arrival_times[arrived] = start_time
+            self.num_active -= arrived.size
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import fields
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Optional
+
+from src.config import Config
+from src.files import replace_atomically
+from src.model import POLICY_CODES, POLICY_TABLES
+from src.profiling import profiled
+
+# ------------------- Result keys -------------------
+
+# Bump when an engine changes in a way that changes its results, to invalidate cached results
+RESULT_VERSION = 2
+
+# Config fields that never change a STATISTICS result, so they stay out of its key
+_NON_RESULT_FIELDS = {
+    "output_mode", "screen_width", "screen_height", "display_rate", "time_scale", "max_speed",
+    "render_every", "trajectory_path", "max_wall_time", "telemetry_path", "cache_dir", "cache_max_bytes",
+}
+
+
+def _canonical(value):
+    # 200 and 200.0 are the same config, whichever type a results file stored it as
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (tuple, list)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _policy_digest(policies) -> str:
+    # Guards against policy code changes that forgot to bump RESULT_VERSION
+    digest = hashlib.sha256()
+    for name in policies:
+        policy = POLICY_TABLES[POLICY_CODES[name]]
+        digest.update(name.encode())
+        digest.update(policy.probabilities.tobytes())
+        digest.update(repr(policy.light_change_horizon).encode())
+    return digest.hexdigest()
+
+
+def result_key(cfg: Config, kind: str, policies=("street", "avenue"), exclude=frozenset(), **params) -> str:
+    """
+    Content address of a result: a hash of every config field that affects it, the result
+    version, the tables of the policies it uses and any extra parameters of the run.
+    :param kind: what computed the result, eg. "run_simulation"
+    :param exclude: config fields this kind of result does not read, on top of `_NON_RESULT_FIELDS`
+    :param params: extra JSON-able arguments the result depends on
+    """
+    config = {field.name: _canonical(getattr(cfg, field.name)) for field in fields(Config)
+              if field.name not in _NON_RESULT_FIELDS and field.name not in exclude}
+    if cfg.engine.value == "event" and cfg.demand_rate is None:
+        # The event engine has no time step
+        config.pop("frame_rate", None)
+    key = {
+        "version": RESULT_VERSION,
+        "kind": kind,
+        "config": config,
+        "policies": _policy_digest(policies),
+        "params": {name: _canonical(value) for name, value in params.items()},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+# ------------------- Cache -------------------
+
+SIZE_FILE = "_size"
+
+
+class ResultCache:
+    """
+    On-disk cache of result lines, one file per key, shared by every process that opens the
+    same directory:
+
+      cache/_size                  estimated total bytes of the entries
+      cache/ab/ab12...ef.json
+
+    Entries are written atomically (see `replace_atomically`), and a hit refreshes the entry's
+    modification time, so the least recently used entries are the oldest. Every process adds
+    the bytes it writes to the shared `_size` estimate about once per `sync_bytes`, and once the
+    estimate passes `max_bytes` it scans the cache, deletes the oldest entries until it is back
+    under the bound and writes the true size back. Syncs aren't locked, so one can overwrite
+    another's writes; that only delays the next scan, which corrects the estimate. An entry
+    deleted under a reader is just a miss.
+    """
+    def __init__(self, path: str, max_bytes: int = 1 << 30, sync_bytes: int = None):
+        """
+        :param path: cache directory, created if needed
+        :param max_bytes: size the cache is trimmed back to
+        :param sync_bytes: bytes a process writes between updates of the shared size estimate,
+            by default 1% of max_bytes; it can overshoot max_bytes by about this much per process
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_bytes = max(max_bytes // 100, 1) if sync_bytes is None else sync_bytes
+        self.hits = 0
+        self.misses = 0
+        # the shared size estimate as of this process' last sync, None until it has read it
+        self._size: Optional[int] = None
+        # bytes this process wrote since then
+        self._unsynced = 0
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    @profiled("cache.lookup")
+    def get(self, key: str) -> Optional[str]:
+        path = self._entry_path(key)
+        try:
+            with open(path) as file:
+                value = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    @profiled("cache.store")
+    def put(self, key: str, value: str):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = value.encode()
+        replace_atomically(path, lambda tmp_path: _write_bytes(tmp_path, data))
+        # Replacing an existing entry counts twice, which only brings the next scan forward
+        self._unsynced += len(data)
+        if self._size is None or self._unsynced >= self.sync_bytes:
+            self._sync()
+        if self._size + self._unsynced > self.max_bytes:
+            # Other processes may have trimmed the cache since
+            self._sync()
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        """The cached value of `key`, else `compute()`, which is cached"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _size_path(self) -> str:
+        return os.path.join(self.path, SIZE_FILE)
+
+    def _sync(self):
+        # Adds this process' writes to the shared estimate, scanning the cache if it has none yet
+        size = self._read_size()
+        if size is None:
+            self.evict()
+            return
+        self._size = size + self._unsynced
+        if self._unsynced:
+            self._unsynced = 0
+            self._write_size()
+
+    def _read_size(self) -> Optional[int]:
+        try:
+            with open(self._size_path()) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_size(self):
+        os.makedirs(self.path, exist_ok=True)
+        replace_atomically(self._size_path(), lambda tmp_path: _write_bytes(tmp_path, str(self._size).encode()))
+
+    def evict(self, max_bytes: int = None):
+        """
+        Scans the cache, deletes the least recently used entries until it holds at most
+        `max_bytes` and resets the shared size estimate to what is left
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        # Tell the other processes the cache is being trimmed, so they don't all scan it at once
+        provisional = int(0.9 * max_bytes)
+        self._size = provisional
+        self._write_size()
+        entries = []
+        total = 0
+        stale = time.time() - 3600
+        for shard in _scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in _scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # Left behind by a writer that died
+                    if stat.st_mtime < stale:
+                        _remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total > max_bytes:
+            # Trim a little further than needed, so the next writes don't trigger another scan
+            target = 0.9 * max_bytes
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                _remove(path)
+                total -= size
+        # Keep what other processes added to the estimate during the scan, even if the scan saw some of it
+        written_meanwhile = max((self._read_size() or provisional) - provisional, 0)
+        self._size = total + written_meanwhile
+        self._unsynced = 0
+        self._write_size()
+
+    def size(self) -> int:
+        """Total bytes of the cached entries, from a scan"""
+        total = 0
+        for shard in _scandir(self.path):
+            if shard.is_dir():
+                for entry in _scandir(shard.path):
+                    if entry.name.endswith(".json"):
+                        try:
+                            total += entry.stat().st_size
+                        except FileNotFoundError:
+                            # evicted by another process
+                            pass
+        return total
+
+
+def _scandir(path: str):
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except FileNotFoundError:
+        return []
+
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def _remove(path: str):
+    # Another process may have evicted it first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def open_cache(path: str, max_bytes: int) -> ResultCache:
+    """The process' `ResultCache` of a directory, which keeps its hit and miss counts across runs"""
+    return ResultCache(path, max_bytes)
+
+
+def config_cache(cfg: Config) -> Optional[ResultCache]:
+    """The result cache of `cfg`, None if it has none or its results must not be reused"""
+    if cfg.cache_dir is None or cfg.traffic_light_grid_random_seed is None:
+        # No seed means a fresh random city every run
+        return None
+    if cfg.telemetry_path is not None:
+        # The run has to fill the telemetry file
+        return None
+    return open_cache(cfg.cache_dir, cfg.cache_max_bytes)
@@ -9,13 +9,41 @@ class OutputMode(str, Enum):
     NONE = "none"   # headless (model only, no output)
 
 
+class Engine(str, Enum):
+    TICK = "tick"     # fixed dt of 1 / frame_rate per step
+    EVENT = "event"   # jumps from one corner arrival / light change to the next (STATISTICS only)
+    BATCH = "batch"   # same fixed dt as TICK, walkers stepped as NumPy arrays (STATISTICS only)
+
+
 @dataclass
 class Config:
     # Visualization
     output_mode: OutputMode = OutputMode.PYGAME
     screen_width: int = 800
     screen_height: int = 800
-    frame_rate: int = 60
+    frame_rate: int = 60   # model steps per simulated second (dt = 1 / frame_rate)
+    engine: Engine = Engine.TICK
+
+    # PYGAME: the window is drawn at display_rate fps, independently of the model step.
+    # time_scale is simulated seconds per real second; max_speed steps the model as fast as
+    # possible and only draws every render_every-th step
+    display_rate: int = 60
+    time_scale: float = 1.0
+    max_speed: bool = False
+    render_every: int = 1
+    # JSON / NONE modes: stream full trajectories to this binary file (see src/trajectory.py)
+    trajectory_path: str = None
+    # STATISTICS mode and trajectory recording: stop once this much simulated time (seconds) or
+    # wall clock time (seconds) has passed, even if walkers haven't arrived. None = unlimited
+    max_sim_time: float = None
+    max_wall_time: float = None
+    # STATISTICS mode: save per intersection wait / crossing counters here, as heatmaps or as
+    # arrays if it ends in .npz (see src/telemetry.py). None = not collected at all
+    telemetry_path: str = None
+    # STATISTICS mode: reuse results of identical runs from this on-disk cache (see src/cache.py),
+    # trimmed to the least recently used cache_max_bytes. None = no cache
+    cache_dir: str = None
+    cache_max_bytes: int = 1 << 30
 
     # Simulation world
     num_streets: int = 5
@@ -31,10 +59,15 @@ class Config:
     #                                         green, red
     avenue_traffic_light_cycle_times: tuple[float, float] = (15.0, 20.0)
     traffic_light_grid_random_seed: int = None
+    # which run of the seed this is: every run id gets its own city and walker random streams
+    run_id: int = 0
 
     # Agents
     walker_speed: float = 60.0
     walker_starting_corner: str = "sw"
+    # STATISTICS mode, tick engine: instead of the two walkers, spawn walkers between random corners
+    # at this many per second until max_sim_time (see src/demand.py). None = off
+    demand_rate: float = None
 
 def get_default_config() -> Config:
     return Config()
@@ -1,16 +1,102 @@
 import json
-from os import environ
+import math
+import time
+
+import numpy as np
+
+from src.batch import BatchSimulation, WalkerBatch
+from src.cache import config_cache, result_key
+from src.config import OutputMode, Engine
+from src.events import EventSimulation
+from src.model import CityGrid, Walker, CitySimulation, DEMAND_STREAM, WALKER_STREAM, python_rng, run_seed_sequence
+from src.profiling import span
+from src.telemetry import IntersectionTelemetry
+
+def config_summary(cfg) -> dict:
+    """The config fields reported next to the walker costs of a STATISTICS run"""
+    return {
+        "num_streets": cfg.num_streets,
+        "num_avenues": cfg.num_avenues,
+        "street_block_length": cfg.street_block_length,
+        "street_crosswalk_length": cfg.street_crosswalk_length,
+        "avenue_block_length": cfg.avenue_block_length,
+        "avenue_crosswalk_length": cfg.avenue_crosswalk_length,
+        "green_time": cfg.avenue_traffic_light_cycle_times[0],
+        "red_time": cfg.avenue_traffic_light_cycle_times[1],
+        "traffic_light_grid_random_seed": cfg.traffic_light_grid_random_seed,
+        "run_id": cfg.run_id,
+        "walker_speed": cfg.walker_speed,
+        "walker_starting_corner": cfg.walker_starting_corner
+    }
+
+
+def replay_simulation(cfg, path: str):
+    """Plays back a trajectory recorded with `cfg.trajectory_path` in the pygame Visualizer"""
+    # Imported here so that headless modes never load pygame
+    from src.trajectory import TrajectoryReader
+    from src.view import run_replay
+    run_replay(cfg, TrajectoryReader(path))
+
+
+def run_demand(cfg, grid: CityGrid, rng, deadline: float = None, telemetry: IntersectionTelemetry = None) -> dict:
+    """
+    Continuous demand STATISTICS run: walkers spawn between random corners at `cfg.demand_rate`
+    per second (see `src.demand`) until `cfg.max_sim_time`, and the row holds the mean travel time
+    and number of finished trips of each policy.
+    :param rng: generator the walkers' probabilistic policies draw from
+    :param deadline: optional wall clock limit, a `time.perf_counter()` value
+    :param telemetry: optional counters to record waits and crossings in
+    """
+    # Imported here so that the fixed population runs don't pay for it
+    from src.demand import DemandSimulation, poisson_trips, policy_travel_times
+
+    if cfg.engine != Engine.TICK:
+        raise Exception(f"Continuous demand runs need the tick engine, not {cfg.engine.value}")
+    if cfg.max_sim_time is None:
+        raise Exception("Continuous demand never runs out, set max_sim_time (--time)")
+
+    demand_rng = np.random.default_rng(run_seed_sequence(cfg.traffic_light_grid_random_seed, cfg.run_id, DEMAND_STREAM))
+    sim = DemandSimulation(grid, poisson_trips(grid, cfg.demand_rate, demand_rng, speed=cfg.walker_speed),
+                           rng=rng, telemetry=telemetry)
+    dt = 1 / cfg.frame_rate
+    stopped = "sim_time"
+    while sim.time < cfg.max_sim_time:
+        if deadline is not None and time.perf_counter() >= deadline:
+            stopped = "wall_time"
+            break
+        sim.step(dt, snapshot=False)
+
+    result = {}
+    for policy, travel_times in policy_travel_times(sim.retired).items():
+        result[f"{policy}_policy"] = float(travel_times.mean())
+        result[f"{policy}_trips"] = int(travel_times.size)
+    return result | {
+        "spawned": sim.num_spawned,
+        "active": sim.num_active,
+        "stopped": stopped,
+        "demand_rate": cfg.demand_rate,
+    }
 
-# Suppresses the message: 'Hello from the pygame community.' on startup
-environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 
-import pygame
+def run_simulation(cfg):
+    cache = config_cache(cfg) if cfg.output_mode == OutputMode.STATISTICS else None
+    if cache is None:
+        return _run_simulation(cfg)
+
+    key = result_key(cfg, "run_simulation")
+    ret = cache.get(key)
+    if ret is not None:
+        with span("output.print"):
+            print(ret)
+        return ret
+    ret = _run_simulation(cfg)
+    # A run cut short by the wall clock depends on the machine, so it isn't reused
+    if json.loads(ret)["stopped"] != "wall_time":
+        cache.put(key, ret)
+    return ret
 
-from src.config import OutputMode
-from src.model import CityGrid, Walker, CitySimulation
-from src.view import Visualizer, Viewport
 
-def run_simulation(cfg):
+def _run_simulation(cfg):
     # Initialize grid
     grid = CityGrid(
         num_streets=cfg.num_streets,
@@ -21,9 +107,12 @@ def run_simulation(cfg):
         avenue_crosswalk_length=cfg.avenue_crosswalk_length,
         avenue_traffic_light_cycle_times=cfg.avenue_traffic_light_cycle_times,
         traffic_light_grid_random_seed=cfg.traffic_light_grid_random_seed,
+        run_id=cfg.run_id,
     )
 
-    # Initialize walkers
+    # Initialize walkers, all drawing from the run's walker stream
+    walker_stream = run_seed_sequence(cfg.traffic_light_grid_random_seed, cfg.run_id, WALKER_STREAM)
+    rng = python_rng(walker_stream)
     walkers = [
         Walker(
             walker_id="0",
@@ -34,6 +123,7 @@ def run_simulation(cfg):
             grid=grid,
             destination_corner=(cfg.num_streets - 1, cfg.num_avenues - 1, "nw"),
             policy="street",
+            rng=rng,
         ),
         Walker(
             walker_id="1",
@@ -44,67 +134,103 @@ def run_simulation(cfg):
             grid=grid,
             destination_corner=(cfg.num_streets - 1, cfg.num_avenues - 1, "nw"),
             policy="avenue",
+            rng=rng,
         )
     ]
 
-    sim = CitySimulation(grid, walkers)
+    # Wait and crossing counters of a STATISTICS run, saved to cfg.telemetry_path at the end
+    telemetry = None
+    if cfg.telemetry_path and cfg.output_mode == OutputMode.STATISTICS:
+        telemetry = IntersectionTelemetry(grid)
 
-    if cfg.output_mode == OutputMode.JSON:
-        for i in range(20):
-            print(sim.step(1).__dict__)
+    sim = CitySimulation(grid, walkers, telemetry)
 
-    elif cfg.output_mode == OutputMode.PYGAME:
-        # Setup Pygame
-        pygame.init()
-        screen = pygame.display.set_mode((cfg.screen_width, cfg.screen_height))
-        pygame.display.set_caption("City Simulation")
-        viewport = Viewport(grid.width, grid.height, cfg.screen_width, cfg.screen_height)
-        vis = Visualizer(screen, viewport)
-        clock = pygame.time.Clock()
+    # Budgets of the headless loops below, which otherwise run until every walker has arrived
+    max_sim_time = math.inf if cfg.max_sim_time is None else cfg.max_sim_time
+    deadline = None if cfg.max_wall_time is None else time.perf_counter() + cfg.max_wall_time
+    dt = 1 / cfg.frame_rate
+
+    if cfg.trajectory_path and cfg.output_mode in (OutputMode.JSON, OutputMode.NONE):
+        # Imported here so that other modes don't pay for it
+        from src.trajectory import TrajectoryWriter
 
-        running = True
+        with TrajectoryWriter(cfg.trajectory_path, grid) as writer:
+            writer.write_walkers(sim.time, sim.walkers)
+            while sim.num_active and sim.time < max_sim_time:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                sim.step(dt, snapshot=False)
+                writer.write_walkers(sim.time, sim.walkers)
 
-        while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
+    elif cfg.output_mode == OutputMode.JSON:
+        for i in range(20):
+            state = sim.step(1)
+            with span("output.print"):
+                print(json.dumps({"time": state.time, "walkers": state.walkers}))
 
-            dt = 1 / cfg.frame_rate
-            state = sim.step(dt)
-            vis.draw(state, grid)
-            pygame.display.flip()
-            clock.tick(cfg.frame_rate)
+    elif cfg.output_mode == OutputMode.PYGAME:
+        # Imported here so that headless modes never load pygame
+        from src.view import run_pygame
+        run_pygame(cfg, sim)
 
-        pygame.quit()
+    elif cfg.output_mode == OutputMode.STATISTICS and cfg.demand_rate:
+        ret = json.dumps(run_demand(cfg, grid, rng, deadline, telemetry) | config_summary(cfg))
+        if telemetry is not None:
+            telemetry.save(cfg.telemetry_path)
 
-    elif cfg.output_mode == OutputMode.STATISTICS:
+        with span("output.print"):
+            print(ret)
+        return ret
 
+    elif cfg.output_mode == OutputMode.STATISTICS:
+        # Every engine reports arrivals once, and a walker's cost is its arrival time.
+        # The tick engines record an arrival at the start of its step, ie. a cost is the sum of
+        # the dts of the steps the walker was still on its way after.
+
+        if cfg.engine == Engine.EVENT:
+            event_sim = EventSimulation(grid, walkers, telemetry)
+            stopped = event_sim.run(until=cfg.max_sim_time, deadline=deadline)
+            arrival_times = event_sim.arrival_times
+
+        elif cfg.engine == Engine.BATCH:
+            batch_sim = BatchSimulation(grid, WalkerBatch.from_walkers(grid, walkers, rng=walker_stream), telemetry)
+            stopped = "arrived"
+            while batch_sim.num_active:
+                if batch_sim.time >= max_sim_time:
+                    stopped = "sim_time"
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    stopped = "wall_time"
+                    break
+                batch_sim.step(dt)
+            arrival_times = {
+                walker.id: arrival_time
+                for walker, arrival_time in zip(walkers, batch_sim.arrival_times.tolist())
+                if not math.isnan(arrival_time)
+            }
+
+        else:
+            stopped = "arrived"
+            while sim.num_active:
+                if sim.time >= max_sim_time:
+                    stopped = "sim_time"
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    stopped = "wall_time"
+                    break
+                sim.step(dt, snapshot=False)
+            arrival_times = sim.arrival_times
+
+        # Walkers still on their way when a budget ran out have no cost
         walker_costs = {
-            f"{walker.policy}_policy": 0
-            for walker in sim.walkers
+            f"{walker.policy}_policy": arrival_times.get(walker.id)
+            for walker in walkers
         }
 
-        while not all(walker.destination_corner == (walker.street_idx, walker.avenue_idx, walker.corner) for walker in sim.walkers):
-            dt = 1 / cfg.frame_rate
-            sim.step(dt)
-            for walker in sim.walkers:
-                if walker.destination_corner != (walker.street_idx, walker.avenue_idx, walker.corner):
-                    walker_costs[f"{walker.policy}_policy"] += dt
-
-
-        ret = json.dumps(walker_costs | {
-            "num_streets": cfg.num_streets,
-            "num_avenues": cfg.num_avenues,
-            "street_block_length": cfg.street_block_length,
-            "street_crosswalk_length": cfg.street_crosswalk_length,
-            "avenue_block_length": cfg.avenue_block_length,
-            "avenue_crosswalk_length": cfg.avenue_crosswalk_length,
-            "green_time": cfg.avenue_traffic_light_cycle_times[0],
-            "red_time": cfg.avenue_traffic_light_cycle_times[1],
-            "traffic_light_grid_random_seed": cfg.traffic_light_grid_random_seed,
-            "walker_speed": cfg.walker_speed,
-            "walker_starting_corner": cfg.walker_starting_corner
-        })
-
-        print(ret)
+        ret = json.dumps(walker_costs | {"stopped": stopped} | config_summary(cfg))
+        if telemetry is not None:
+            telemetry.save(cfg.telemetry_path)
+
+        with span("output.print"):
+            print(ret)
         return ret
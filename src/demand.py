@@ -0,0 +1,186 @@
+import random
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from src.model import CityGrid, SimulationState, Walker, WalkerSimulation, CORNERS, POLICY_CODES
+from src.profiling import profiled
+
+
+# ------------------- Trip streams -------------------
+
+@dataclass(frozen=True)
+class Trip:
+    departure_time: float
+    origin: tuple[int, int, str]        # (street_idx, avenue_idx, corner)
+    destination: tuple[int, int, str]
+    policy: str
+    speed: float
+
+
+def poisson_trips(grid: CityGrid,
+                  rate: Union[float, Callable[[float], float]],
+                  rng: np.random.Generator,
+                  policies: Sequence[str] = ("street", "avenue"),
+                  speed: float = 60.0,
+                  peak_rate: float = None,
+                  start_time: float = 0.0,
+                  chunk_size: int = 1024) -> Iterator[Trip]:
+    """
+    Endless stream of trips between uniformly random corners, departing as a Poisson process,
+    in departure time order. Trips are drawn `chunk_size` at a time as they are consumed, so a
+    whole day of demand is never held in memory.
+    :param rate: trips per second, or a function of the simulation time for demand that varies over the day
+    :param rng: generator to draw from, usually seeded from the run's DEMAND_STREAM
+    :param policies: every trip follows one of these, picked uniformly
+    :param speed: walker speed in m/s
+    :param peak_rate: upper bound of a time varying `rate`, whose process is thinned from this one
+    :param start_time: simulation time the process starts at
+    """
+    if callable(rate) and peak_rate is None:
+        raise Exception("A time varying rate needs a peak_rate")
+    max_rate = peak_rate if callable(rate) else rate
+    if max_rate <= 0:
+        raise Exception(f"Trip rate must be positive, got {max_rate}")
+
+    world_time = start_time
+    while True:
+        departure_times = world_time + np.cumsum(rng.exponential(1 / max_rate, chunk_size))
+        world_time = departure_times[-1]
+        streets = rng.integers(grid.num_streets, size=(2, chunk_size)).tolist()
+        avenues = rng.integers(grid.num_avenues, size=(2, chunk_size)).tolist()
+        corners = rng.integers(len(CORNERS), size=(2, chunk_size)).tolist()
+        policy_idx = rng.integers(len(policies), size=chunk_size).tolist()
+        if callable(rate):
+            # Thinning: keep each candidate with probability rate(t) / peak_rate
+            keep = (rng.random(chunk_size) * max_rate < [rate(t) for t in departure_times.tolist()]).tolist()
+        else:
+            keep = [True] * chunk_size
+
+        for k, departure_time in enumerate(departure_times.tolist()):
+            if keep[k]:
+                yield Trip(
+                    departure_time=departure_time,
+                    origin=(streets[0][k], avenues[0][k], CORNERS[corners[0][k]]),
+                    destination=(streets[1][k], avenues[1][k], CORNERS[corners[1][k]]),
+                    policy=policies[policy_idx[k]],
+                    speed=speed,
+                )
+
+
+# ------------------- Finished trips -------------------
+
+class TripLog:
+    """Compact record of finished trips, one typed array per column (about 25 bytes per trip)"""
+    def __init__(self):
+        self.walker_idx = array("q")        # spawn index, the walker id is its str
+        self.policy_code = array("b")
+        self.departure_time = array("d")
+        self.arrival_time = array("d")
+
+    def __len__(self):
+        return len(self.walker_idx)
+
+    def append(self, walker_idx: int, policy_code: int, departure_time: float, arrival_time: float):
+        self.walker_idx.append(walker_idx)
+        self.policy_code.append(policy_code)
+        self.departure_time.append(departure_time)
+        self.arrival_time.append(arrival_time)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Copies of the columns as NumPy arrays, plus the travel time of every trip"""
+        columns = {name: np.array(getattr(self, name)) for name in ("walker_idx", "policy_code", "departure_time", "arrival_time")}
+        columns["travel_time"] = columns["arrival_time"] - columns["departure_time"]
+        return columns
+
+
+# ------------------- Simulation -------------------
+
+class DemandSimulation(WalkerSimulation):
+    """
+    Counterpart to `CitySimulation` with a continuous demand: walkers spawn as their trips
+    depart and retire into `retired` once they arrive. `walkers` only ever holds the walkers on
+    the street, so the cost of a step and of a snapshot scales with them, not with everyone
+    spawned so far.
+
+    A trip departing during a step spawns at the start of that step, ie. departure times are
+    rounded down to the tick, and like in `CitySimulation` an arrival is recorded at the start
+    of the step it happens in. Travel times are therefore whole numbers of steps, like the costs
+    of a STATISTICS run.
+    """
+    def __init__(self, grid: CityGrid, trips: Iterable[Trip], rng: random.Random = None, telemetry=None):
+        """
+        :param trips: trips in departure time order, usually an endless `poisson_trips` stream
+        :param rng: generator the walkers' probabilistic policies draw from, see `python_rng`; needed if any trip follows one
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` to record waits and crossings in
+        """
+        super().__init__(grid, [], telemetry)
+        self.rng = rng
+        self.retired = TripLog()
+        self.num_spawned = 0
+        self._trips = iter(trips)
+        self._next_trip: Optional[Trip] = next(self._trips, None)
+        # walker id -> (spawn index, departure time), for the walkers on the street
+        self._departures: Dict[str, Tuple[int, float]] = {}
+
+    @property
+    def num_active(self) -> int:
+        return len(self.walkers)
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether every trip of the stream has spawned"""
+        return self._next_trip is None
+
+    @profiled("model.step")
+    def step(self, dt: float, snapshot: bool = True) -> Optional[SimulationState]:
+        """
+        Advances the simulation by dt seconds, spawning the trips that depart during the step
+        and retiring the walkers that arrive.
+        :param snapshot: whether to build and return the state afterwards, skip it when nobody reads it
+        :return: `snapshot()` if requested, otherwise None
+        """
+        start_time = self.time
+        self.time += dt
+        while self._next_trip is not None and self._next_trip.departure_time < self.time:
+            self._spawn(self._next_trip, start_time)
+            self._next_trip = next(self._trips, None)
+
+        arrived = False
+        telemetry = self.telemetry
+        for w in self.walkers:
+            if w.update(dt, self.time, telemetry):
+                self._retire(w, start_time)
+                arrived = True
+        if arrived:
+            # Compact the active set
+            self.walkers = [w for w in self.walkers if not w.at_destination()]
+        if snapshot:
+            return self.snapshot()
+        return None
+
+    def _spawn(self, trip: Trip, world_time: float):
+        walker = Walker(str(self.num_spawned), *trip.origin, trip.speed, trip.destination, trip.policy, self.grid,
+                        rng=self.rng, world_time=world_time)
+        self._departures[walker.id] = (self.num_spawned, world_time)
+        self.num_spawned += 1
+        if walker.at_destination():
+            self._retire(walker, world_time)
+        else:
+            self.walkers.append(walker)
+
+    def _retire(self, walker: Walker, world_time: float):
+        walker_idx, departure_time = self._departures.pop(walker.id)
+        self.retired.append(walker_idx, walker.policy_code, departure_time, world_time)
+
+
+def policy_travel_times(retired: TripLog) -> Dict[str, np.ndarray]:
+    """Travel times of the finished trips of every policy that has any"""
+    columns = retired.columns()
+    return {
+        policy: columns["travel_time"][columns["policy_code"] == code]
+        for policy, code in POLICY_CODES.items()
+        if (columns["policy_code"] == code).any()
+    }
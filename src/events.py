@@ -0,0 +1,142 @@
+import heapq
+import time
+from typing import Dict, List, Optional
+
+from src.model import CityGrid, Walker, AVENUE_CROSSWALK, STREET_CROSSWALK
+from src.profiling import profiled
+
+
+# ------------------- Event-driven simulation -------------------
+
+def crosswalk_wait(walker: Walker, world_time: float) -> float:
+    """
+    Seconds the walker has to wait at its current corner before it may start
+    moving towards its target. Mirrors the gating in `Walker.update`, but instead
+    of skipping a tick it returns the time until the relevant light turns green.
+    :param walker: walker that has just picked its next target
+    :param world_time: simulation time at which the walker wants to leave
+    :return: 0.0 if the walker can leave immediately, otherwise the wait in seconds
+    """
+    grid = walker.grid
+    if walker.target_street_idx != walker.street_idx or walker.target_avenue_idx != walker.avenue_idx:
+        # Walking along a block, no light to wait for
+        return 0.0
+
+    avenue_light_is_green = grid.avenue_light_is_green(walker.avenue_idx, walker.street_idx, world_time)
+
+    if (walker.corner_code ^ walker.target_corner_code) & 2:
+        # North/south (street) crosswalk, needs the avenue light to be red
+        if avenue_light_is_green:
+            return grid.time_to_light_change(walker.avenue_idx, walker.street_idx, world_time)
+        return 0.0
+    elif (walker.corner_code ^ walker.target_corner_code) & 1:
+        # East/west (avenue) crosswalk, needs the avenue light to be green
+        if avenue_light_is_green:
+            return 0.0
+        return grid.time_to_light_change(walker.avenue_idx, walker.street_idx, world_time)
+    raise Exception(f"Bad state, corner transition: {walker.corner} -> {walker.target[2]}")
+
+
+class EventSimulation:
+    """
+    Next-event counterpart to `CitySimulation`. Instead of advancing every walker
+    by a fixed dt, time jumps straight to the next walker reaching a corner; a walker
+    stopped at a red light is scheduled to leave exactly when its light changes.
+    The cost of a run is O(corner transitions) and arrival times carry no tick
+    rounding error.
+    """
+    def __init__(self, grid: CityGrid, walkers: List[Walker], telemetry=None):
+        """
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` to record waits and crossings in
+        """
+        self.grid = grid
+        self.walkers = walkers
+        self.telemetry = telemetry
+        self.time: float = 0.0
+        self.arrival_times: Dict[str, float] = {}
+        # heap of (time the walker reaches its target corner, walker index)
+        self._queue: List[tuple[float, int]] = []
+        # with telemetry: (crosswalk, wait not recorded yet, departure time) of every walker whose
+        # queued move crosses at an intersection, recorded as the wait and the crossing happen
+        self._crossings: List[Optional[tuple[int, float, float]]] = [None] * len(walkers)
+        for idx, walker in enumerate(self.walkers):
+            self._schedule(idx, self.time)
+
+    @property
+    def num_active(self) -> int:
+        """Number of walkers that haven't reached their destination yet, each has one queued event"""
+        return len(self._queue)
+
+    def _schedule(self, idx: int, world_time: float):
+        walker = self.walkers[idx]
+        if (walker.target_corner_code == walker.corner_code
+                and walker.target_street_idx == walker.street_idx
+                and walker.target_avenue_idx == walker.avenue_idx):
+            # Walker stays put, so it has reached its destination
+            self.arrival_times[walker.id] = world_time
+            return
+        wait = crosswalk_wait(walker, world_time)
+        if (self.telemetry is not None
+                and walker.target_street_idx == walker.street_idx
+                and walker.target_avenue_idx == walker.avenue_idx):
+            # Crossing at this intersection
+            crosswalk = STREET_CROSSWALK if (walker.corner_code ^ walker.target_corner_code) & 2 else AVENUE_CROSSWALK
+            self._crossings[idx] = (crosswalk, wait, world_time + wait)
+        depart_time = world_time + wait
+        heapq.heappush(self._queue, (depart_time + self.grid.segment_length / walker.speed, idx))
+
+    def _record_crossing(self, idx: int, world_time: float):
+        """Records the part of walker `idx`'s queued crossing, its wait and its step onto the crosswalk, done by `world_time`"""
+        crosswalk, wait, depart_time = self._crossings[idx]
+        walker = self.walkers[idx]
+        waited = wait if depart_time <= world_time else max(0.0, wait - (depart_time - world_time))
+        if waited > 0:
+            self.telemetry.record_wait(walker, crosswalk, waited)
+        if depart_time <= world_time:
+            self.telemetry.record_crossing(walker, crosswalk)
+            self._crossings[idx] = None
+        else:
+            self._crossings[idx] = (crosswalk, wait - waited, depart_time)
+
+    @profiled("model.event")
+    def step(self) -> bool:
+        """
+        Processes the next corner arrival.
+        :return: False if there are no more events, ie. every walker has arrived
+        """
+        if not self._queue:
+            return False
+        self.time, idx = heapq.heappop(self._queue)
+        if self._crossings[idx] is not None:
+            self._record_crossing(idx, self.time)
+        walker = self.walkers[idx]
+        walker.street_idx = walker.target_street_idx
+        walker.avenue_idx = walker.target_avenue_idx
+        walker.corner_code = walker.target_corner_code
+        walker._set_next_target(world_time=self.time)
+        self._schedule(idx, self.time)
+        return True
+
+    def run(self, until: Optional[float] = None, deadline: Optional[float] = None) -> str:
+        """
+        Processes events until every walker has arrived, the next event is past `until`, or
+        `deadline` has passed. Arrival times are in `arrival_times`. When it stops early, the
+        telemetry gets the waits and crossings of the queued moves up to the stop time.
+        :param until: optional simulation time limit in seconds
+        :param deadline: optional wall clock limit, a `time.perf_counter()` value
+        :return: why it stopped, "arrived", "sim_time" or "wall_time"
+        """
+        while self._queue:
+            if until is not None and self._queue[0][0] > until:
+                self._record_crossings(until)
+                return "sim_time"
+            if deadline is not None and time.perf_counter() >= deadline:
+                self._record_crossings(self.time)
+                return "wall_time"
+            self.step()
+        return "arrived"
+
+    def _record_crossings(self, world_time: float):
+        for idx, crossing in enumerate(self._crossings):
+            if crossing is not None:
+                self._record_crossing(idx, world_time)
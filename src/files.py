@@ -0,0 +1,14 @@
+import os
+from typing import Callable
+
+# ------------------- Atomic writes -------------------
+
+def replace_atomically(path: str, write: Callable[[str], None]):
+    """
+    Creates or replaces the file `path` with one written by `write(tmp_path)` to a private
+    temporary file (`<path>.<pid>.tmp`) and renamed into place once complete, so concurrent
+    readers, in any process, see the old file or the new one, never part of one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
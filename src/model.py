@@ -1,53 +1,98 @@
 from dataclasses import dataclass
+from functools import cached_property
 import random
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-# ------------------- State snapshots for the view -------------------
-@dataclass(frozen=True)
-class StreetCornerLocation:
-    street_idx: int
-    avenue_idx: int
-    corner: str  # "east", "south", "west", "north"
+import numpy as np
 
-@dataclass(frozen=True)
-class WalkerState:
-    id: str
-    x: float
-    y: float
-    direction: str  # "east", "south", "west", "north"
-    current_street_idx: int
-    current_avenue_idx: int
-    target_street_idx: int
-    target_avenue_idx: int
+from src.profiling import profiled
 
+# ------------------- State snapshots for the view -------------------
 @dataclass(frozen=True)
 class SimulationState:
     time: float
     walkers: List[dict]
 
 
+# ------------------- Encodings -------------------
+
+# Integer encodings shared by the array-based engines.
+# Corner code = 2 * is_south + is_east, so `code >> 1` is the n/s half and `code & 1` the w/e half.
+CORNERS = ("nw", "ne", "sw", "se")
+CORNER_CODES = {corner: code for code, corner in enumerate(CORNERS)}
+DIRECTIONS = ("north", "east", "south", "west")
+STAY = -1
+# Crosswalks of an intersection by the direction they are crossed in: the street crosswalk
+# north/south (a change of corner n/s half), the avenue crosswalk east/west
+CROSSWALKS = ("street", "avenue")
+STREET_CROSSWALK, AVENUE_CROSSWALK = range(len(CROSSWALKS))
+# Registered policy names, indexed by policy code, see `register_policy`
+POLICIES: List[str] = []
+POLICY_CODES: dict[str, int] = {}
+
+# corner -> (index into (left, right) avenue edges, index into (top, bottom) street edges)
+_CORNER_EDGES = {
+    "nw": (0, 1),
+    "ne": (1, 1),
+    "sw": (0, 0),
+    "se": (1, 0),
+}
+
+
+# ------------------- Random streams -------------------
+#
+# Nothing draws from the global `random` / `np.random` state: walkers of probabilistic
+# policies need an explicit rng, and every other draw is seeded. A run is identified by
+# (seed, run_id) and owns one independent numpy SeedSequence stream per purpose, so runs can
+# be generated in any order or in parallel, and any single one regenerated from its run id.
+
+CITY_STREAM, WALKER_STREAM, DEMAND_STREAM = range(3)
+
+
+def run_seed_sequence(seed: Optional[int], run_id: int = 0, stream: int = CITY_STREAM) -> np.random.SeedSequence:
+    """
+    The `stream` stream of run `run_id`, ie. `np.random.SeedSequence(seed).spawn(...)[run_id].spawn(...)[stream]`
+    built straight from its spawn key, without spawning the runs before it.
+    :param seed: root seed shared by every run of a sweep, None for fresh OS entropy
+    :param run_id: index of the run, any non-negative int
+    :param stream: CITY_STREAM (light offsets), WALKER_STREAM (probabilistic policies) or
+        DEMAND_STREAM (spawned trips, see `src.demand`)
+    """
+    return np.random.SeedSequence(seed, spawn_key=(run_id, stream))
+
+
+def python_rng(seed_sequence: np.random.SeedSequence) -> random.Random:
+    """A `random.Random` seeded from a SeedSequence, for one draw at a time in the scalar engines"""
+    return random.Random(int.from_bytes(seed_sequence.generate_state(4).tobytes(), "little"))
+
+
 # ------------------- City Grid -------------------
 
-def create_traffic_light_grid(num_streets: int, num_avenues: int, cycle_length: float, rndm_seed: int) -> dict[tuple[int, int], float]:
+def create_traffic_light_offsets(num_streets: int, num_avenues: int, cycle_length: float, rndm_seed: int, run_id: int = 0) -> np.ndarray:
     """
-    Creates the offset grid for the traffic light cycles.
+    Draws the offset grid for the traffic light cycles from the city stream of the run.
     :param num_avenues: number of avenues in the simulation
     :param num_streets: number of streets in the simulation
     :param cycle_length: total length of the green + red time in seconds
-    :param rndm_seed: random number generator seed to use
+    :param rndm_seed: random number generator seed to use, None for a new random city
+    :param run_id: run whose stream to draw from, see `run_seed_sequence`
+    :return: (num_avenues, num_streets) array of the number of seconds each intersection's
+        traffic light initial offset is in its cycle, (ie. 1.2s means when the simulation
+        starts, this intersection will begin 1.2s into its cycle)
+    """
+    rng = np.random.default_rng(run_seed_sequence(rndm_seed, run_id, CITY_STREAM))
+    return rng.random((num_avenues, num_streets)) * cycle_length
+
+
+def create_traffic_light_grid(num_streets: int, num_avenues: int, cycle_length: float, rndm_seed: int, run_id: int = 0) -> dict[tuple[int, int], float]:
+    """
+    `create_traffic_light_offsets` as a dictionary
     :return: Dictionary
         keys: tuple(int, int), representing (avenue_index, street_index) intersection
-        values: float, representing the number of seconds the given intersection's
-            traffic light initial offset is in its cycle, (ie. 1.2s means when the simulation
-            starts, this intersection will begin 1.2s into its cycle)
+        values: float, the intersection's light offset in seconds
     """
-    if rndm_seed:
-        random.seed(rndm_seed)
-    d = dict()
-    for x in range(num_avenues):
-        for y in range(num_streets):
-            d[(x,y)] = random.random() * cycle_length
-    return d
+    offsets = create_traffic_light_offsets(num_streets, num_avenues, cycle_length, rndm_seed, run_id)
+    return {(x, y): offset for x, row in enumerate(offsets.tolist()) for y, offset in enumerate(row)}
 
 
 class CityGrid:
@@ -61,7 +106,14 @@ class CityGrid:
         avenue_crosswalk_length: float,
         avenue_traffic_light_cycle_times: tuple[float, float],
         traffic_light_grid_random_seed: int = None,
+        traffic_light_offsets: Optional[np.ndarray] = None,
+        run_id: int = 0,
     ):
+        """
+        :param traffic_light_offsets: optional (num_avenues, num_streets) array of known light
+            offsets, eg. from a recording; when given, no offsets are generated from the seed
+        :param run_id: run of `traffic_light_grid_random_seed` whose city to generate, see `run_seed_sequence`
+        """
         # city size
         self.num_streets = num_streets
         self.num_avenues = num_avenues
@@ -76,6 +128,9 @@ class CityGrid:
         self.street_spacing = street_block_length + street_crosswalk_length
         self.avenue_spacing = avenue_block_length + avenue_crosswalk_length
 
+        # every corner-to-corner move (block or crosswalk) is normalised to this length
+        self.segment_length = max(self.street_spacing, self.avenue_spacing)
+
         # total dimensions
         self.width = num_avenues * self.avenue_spacing + avenue_block_length
         self.height = num_streets * self.street_spacing + street_block_length
@@ -84,25 +139,127 @@ class CityGrid:
         self.avenue_traffic_light_cycle_times = avenue_traffic_light_cycle_times
         self.traffic_light_cycle_length = self.avenue_traffic_light_cycle_times[0] + self.avenue_traffic_light_cycle_times[1]
         self.traffic_light_grid_random_seed = traffic_light_grid_random_seed
-        self.traffic_light_grid = create_traffic_light_grid(
-            self.num_streets,
-            self.num_avenues,
-            self.traffic_light_cycle_length,
-            self.traffic_light_grid_random_seed,
-        )
+        self.run_id = run_id
+        # traffic_light_offsets[avenue, street]
+        if traffic_light_offsets is None:
+            self.traffic_light_offsets = create_traffic_light_offsets(
+                self.num_streets,
+                self.num_avenues,
+                self.traffic_light_cycle_length,
+                self.traffic_light_grid_random_seed,
+                self.run_id,
+            )
+        else:
+            self.traffic_light_offsets = np.array(traffic_light_offsets, dtype=np.float64).reshape(self.num_avenues, self.num_streets)
+        # the same table as nested lists, for fast scalar queries
+        self._traffic_light_offsets = self.traffic_light_offsets.tolist()
+
+        # coordinate lookup tables, built once
+        self._build_coordinate_tables()
+
+    @cached_property
+    def traffic_light_grid(self) -> dict[tuple[int, int], float]:
+        """
+        The light offsets keyed by (avenue_idx, street_idx), see `create_traffic_light_grid`.
+        Built on first access; the engines read `traffic_light_offsets` instead.
+        """
+        return {(x, y): offset for x, row in enumerate(self._traffic_light_offsets) for y, offset in enumerate(row)}
+
+    def _build_coordinate_tables(self):
+        # crosswalk edges
+        lefts = np.arange(self.num_avenues) * self.avenue_spacing + self.avenue_block_length
+        rights = lefts + self.avenue_crosswalk_length
+        tops = np.arange(self.num_streets) * self.street_spacing + self.street_block_length
+        bottoms = tops + self.street_crosswalk_length
+        self._avenue_edges = list(zip(lefts.tolist(), rights.tolist()))
+        self._street_edges = list(zip(tops.tolist(), bottoms.tolist()))
+
+        # corner_coordinates[street, avenue, corner_code] -> (x, y)
+        xs = np.stack([lefts, rights, lefts, rights])               # nw, ne, sw, se
+        ys = np.stack([bottoms, bottoms, tops, tops])
+        self.corner_coordinates = np.empty((self.num_streets, self.num_avenues, len(CORNERS), 2))
+        self.corner_coordinates[..., 0] = xs.T[np.newaxis, :, :]
+        self.corner_coordinates[..., 1] = ys.T[:, np.newaxis, :]
+
+        # intersection_coordinates[avenue, street] -> (x, y), indexed like traffic_light_grid
+        self.intersection_coordinates = np.empty((self.num_avenues, self.num_streets, 2))
+        self.intersection_coordinates[..., 0] = (lefts + (self.avenue_crosswalk_length / 2))[:, np.newaxis]
+        self.intersection_coordinates[..., 1] = (tops + (self.street_crosswalk_length / 2))[np.newaxis, :]
+
+    # Traffic lights
+    #
+    # An intersection's phase is (world_time + offset) % traffic_light_cycle_length.
+    # The avenue light (crossing the avenue east/west) is green for phases above the
+    # green time, and the street light (crossing the street north/south) is green otherwise.
+    def avenue_light_is_green(self, avenue_idx: int, street_idx: int, world_time: float) -> bool:
+        return ((world_time + self._traffic_light_offsets[avenue_idx][street_idx])
+                % self.traffic_light_cycle_length
+                > self.avenue_traffic_light_cycle_times[0])
+
+    def time_to_light_change(self, avenue_idx: int, street_idx: int, world_time: float) -> float:
+        """Seconds until the lights at the intersection next switch"""
+        phase = (world_time + self._traffic_light_offsets[avenue_idx][street_idx]) % self.traffic_light_cycle_length
+        green_time = self.avenue_traffic_light_cycle_times[0]
+        if phase > green_time:
+            return self.traffic_light_cycle_length - phase
+        return green_time - phase
+
+    def avenue_lights_are_green(self, world_time, avenue_idx=None, street_idx=None) -> np.ndarray:
+        """
+        Vectorized `avenue_light_is_green`. Arguments are broadcast against each other.
+        :param world_time: simulation time(s) in seconds
+        :param avenue_idx: avenue indices, or None for the whole grid
+        :param street_idx: street indices, or None for the whole grid
+        :return: boolean array, shaped like `traffic_light_offsets` when no indices are given
+        """
+        return self._light_phases(world_time, avenue_idx, street_idx) > self.avenue_traffic_light_cycle_times[0]
+
+    def times_to_light_change(self, world_time, avenue_idx=None, street_idx=None) -> np.ndarray:
+        """Vectorized `time_to_light_change`, see `avenue_lights_are_green` for the arguments"""
+        phase = self._light_phases(world_time, avenue_idx, street_idx)
+        green_time = self.avenue_traffic_light_cycle_times[0]
+        return np.where(phase > green_time, self.traffic_light_cycle_length - phase, green_time - phase)
+
+    def _light_phases(self, world_time, avenue_idx, street_idx) -> np.ndarray:
+        if avenue_idx is None and street_idx is None:
+            offsets = self.traffic_light_offsets
+        else:
+            offsets = self.traffic_light_offsets[
+                slice(None) if avenue_idx is None else avenue_idx,
+                slice(None) if street_idx is None else street_idx,
+            ]
+        return (np.asarray(world_time) + offsets) % self.traffic_light_cycle_length
+
+    def travel_time_table(self,
+                          policy: str,
+                          origins: List[tuple[int, int, str]],
+                          destinations: List[tuple[int, int, str]],
+                          departure_times: List[float],
+                          speed: float,
+                          cache_dir: str = None) -> np.ndarray:
+        """
+        Travel time of a walker following `policy` for every origin, destination and
+        departure time, solved exactly (see `src.analytic.solve_travel_time`) in one
+        batched pass. Departure times are folded onto one light cycle first, so each
+        distinct phase is only solved once.
+        :param policy: "street" or "avenue"
+        :param origins: (street_idx, avenue_idx, corner) corners to leave from
+        :param destinations: (street_idx, avenue_idx, corner) corners to walk to
+        :param departure_times: simulation times of leaving the origin
+        :param speed: walker speed in m/s
+        :param cache_dir: optional directory to memoize tables in, keyed by the grid
+            parameters, seed, light offsets and all of the arguments above
+        :return: array [origin, destination, departure time] of travel times in seconds
+        """
+        from src.analytic import travel_time_table
+        return travel_time_table(self, policy, origins, destinations, departure_times, speed, cache_dir=cache_dir)
 
     # Drawing helpers (edges of crosswalks)
     def avenue_positions(self):
-        for i in range(self.num_avenues):
-            left = i * self.avenue_spacing + self.avenue_block_length
-            right = left + self.avenue_crosswalk_length
-            yield left, right
+        yield from self._avenue_edges
 
     def street_positions(self):
-        for j in range(self.num_streets):
-            top = j * self.street_spacing + self.street_block_length
-            bottom = top + self.street_crosswalk_length
-            yield top, bottom
+        yield from self._street_edges
 
     def avenue_east(self, idx: int) -> float:
         return idx * self.avenue_spacing + self.avenue_block_length
@@ -117,43 +274,37 @@ class CityGrid:
         return idx * self.street_spacing + self.street_block_length + self.street_crosswalk_length
 
     def intersection_xy(self, avenue_idx: int, street_idx: int, ) -> Tuple[float, float]:
-        return self.avenue_east(avenue_idx) + (self.avenue_crosswalk_length / 2), self.street_north(street_idx) + (self.street_crosswalk_length / 2)
+        left, _ = self._avenue_edges[avenue_idx]
+        top, _ = self._street_edges[street_idx]
+        return left + (self.avenue_crosswalk_length / 2), top + (self.street_crosswalk_length / 2)
+
+    def segment_xy(self, street_idx, avenue_idx, corner_code, target_street_idx, target_avenue_idx, target_corner_code, progress) -> np.ndarray:
+        """
+        Vectorized position of walkers `progress` of the way from their corner to their target corner.
+        :return: (..., 2) array of (x, y) world coordinates
+        """
+        start = self.corner_coordinates[street_idx, avenue_idx, corner_code]
+        end = self.corner_coordinates[target_street_idx, target_avenue_idx, target_corner_code]
+        return start + (end - start) * np.asarray(progress)[..., np.newaxis]
 
     def corner_xy(self, street_idx: int, avenue_idx: int, corner: str):
-        left, right = list(self.avenue_positions())[avenue_idx]
-        top, bottom = list(self.street_positions())[street_idx]
-
-        if corner == "nw":
-            return left, bottom
-        elif corner == "ne":
-            return right, bottom
-        elif corner == "sw":
-            return left, top
-        elif corner == "se":
-            return right, top
-        return None
-
-
-# ------------------- Walker -------------------
-
-_RIGHT_TURN = {
-    "east": "south",
-    "south": "west",
-    "west": "north",
-    "north": "east",
-}
-
-_ZIG_ZAG = {
-    "east": "south",
-    "south": "east"
-}
-
-_DIR_DELTA = {
-    "east":  (0, +1),
-    "west":  (0, -1),
-    "south": (+1, 0),
-    "north": (-1, 0),
-}
+        # Scalar lookups go through the per-axis edge tables (plain floats, O(1)),
+        # vectorized callers should index `corner_coordinates` instead
+        edges = _CORNER_EDGES.get(corner)
+        if edges is None:
+            return None
+        return self._avenue_edges[avenue_idx][edges[0]], self._street_edges[street_idx][edges[1]]
+
+
+# ------------------- Policies -------------------
+#
+# A policy picks the direction a walker heads in when it reaches a corner, from
+#   (corner, n_s_axis, e_w_axis, light state)
+# where the axes are the -1 / 0 / +1 signs towards the destination (see `Walker._set_next_target`)
+# and the light state has bit 0 set if the avenue light is green and bit 1 set if the light
+# changes within the policy's `light_change_horizon` seconds. That is few enough inputs to
+# compile every policy into lookup tables once, when it is registered, so deciding is one
+# lookup for `Walker` and one gather for a whole `WalkerBatch`.
 
 _CORNER_DELTAS = {
     # corner -> list of neighbor corner moves (dj, di, new_corner)
@@ -183,8 +334,169 @@ _CORNER_DELTAS = {
     }
 }
 
+# _CORNER_DELTAS by integer codes: _CORNER_MOVES[corner_code][direction_code] -> (dj, di, new_corner_code)
+_CORNER_MOVES = tuple(
+    tuple((dj, di, CORNER_CODES[new_corner]) for dj, di, new_corner in (_CORNER_DELTAS[corner][d] for d in DIRECTIONS))
+    for corner in CORNERS
+)
+
+LIGHT_STATES = 4
+
+
+def decision_index(corner_code: int, n_s_axis: int, e_w_axis: int, light_state: int) -> int:
+    """Index of a decision in the flattened policy tables"""
+    return ((corner_code * 3 + n_s_axis + 1) * 3 + e_w_axis + 1) * LIGHT_STATES + light_state
+
+
+class Policy:
+    """
+    A walker policy compiled into tables over every decision a walker can face.
+    `probabilities[corner_code, n_s_axis + 1, e_w_axis + 1, light_state, direction_code]`
+    is the chance of heading in each direction; `directions` holds the most likely
+    direction (STAY only at the destination).
+    """
+    __slots__ = ("name", "light_change_horizon", "probabilities", "cumulative", "directions", "deterministic",
+                 "_moves", "_cumulative")
+
+    def __init__(self, name: str, probabilities: np.ndarray, light_change_horizon: float = 0.0):
+        self.name = name
+        self.light_change_horizon = light_change_horizon
+        self.probabilities = probabilities
+        moves = probabilities.any(axis=-1)
+        cumulative = np.cumsum(probabilities, axis=-1)
+        # normalised so the last entry of every decision is exactly 1.0
+        self.cumulative = np.divide(cumulative, cumulative[..., -1:], out=np.zeros_like(cumulative), where=moves[..., None])
+        self.directions = np.where(moves, probabilities.argmax(axis=-1), STAY).astype(np.int8)
+        self.deterministic = bool(np.isin(probabilities, (0.0, 1.0)).all())
+        # Flattened by `decision_index` for scalar lookups: the (dj, di, new_corner_code) move
+        # to make, None to stay, and the cumulative probabilities of every direction
+        corner_codes = np.indices(self.directions.shape)[0].ravel().tolist()
+        self._moves = tuple(
+            None if direction == STAY else _CORNER_MOVES[corner_code][direction]
+            for corner_code, direction in zip(corner_codes, self.directions.ravel().tolist())
+        )
+        self._cumulative = tuple(map(tuple, self.cumulative.reshape(-1, len(DIRECTIONS)).tolist()))
+
+
+def compile_policy(name: str, decide, light_change_horizon: float = 0.0) -> Policy:
+    """
+    :param decide: function (corner, n_s_axis, e_w_axis, avenue_light_is_green, light_changes_soon)
+        returning a direction ("north", "east", "south" or "west"), or a dict of direction -> probability.
+        It is not called at the destination, where walkers always stay put.
+    :param light_change_horizon: seconds before a light change from which `light_changes_soon` is True
+    """
+    probabilities = np.zeros((len(CORNERS), 3, 3, LIGHT_STATES, len(DIRECTIONS)))
+    for corner_code, corner in enumerate(CORNERS):
+        for n_s_axis in (-1, 0, 1):
+            for e_w_axis in (-1, 0, 1):
+                if n_s_axis == 0 and e_w_axis == 0:
+                    continue
+                for light_state in range(LIGHT_STATES):
+                    decision = decide(corner, n_s_axis, e_w_axis, bool(light_state & 1), bool(light_state & 2))
+                    if isinstance(decision, str):
+                        decision = {decision: 1.0}
+                    if not decision or abs(sum(decision.values()) - 1.0) > 1e-9:
+                        raise Exception(f"Policy {name} has no valid decision at {corner} "
+                                        f"with axes ({n_s_axis}, {e_w_axis}) and light state {light_state}: {decision}")
+                    for direction, probability in decision.items():
+                        probabilities[corner_code, n_s_axis + 1, e_w_axis + 1, light_state, DIRECTIONS.index(direction)] = probability
+    return Policy(name, probabilities, light_change_horizon)
+
+
+POLICY_TABLES: List[Policy] = []
+
+
+def register_policy(name: str, decide, light_change_horizon: float = 0.0) -> Policy:
+    """
+    Compiles a policy and makes it available to every engine by name, see `compile_policy`
+    for the arguments. Walkers refer to policies by code, so register custom policies
+    before creating walkers (and in every worker process of a sweep).
+    """
+    if name in POLICY_CODES:
+        raise Exception(f"Policy {name} is already registered")
+    policy = compile_policy(name, decide, light_change_horizon)
+    POLICY_CODES[name] = len(POLICIES)
+    POLICIES.append(name)
+    POLICY_TABLES.append(policy)
+    return policy
+
+
+_stacked_policy_tables: dict[int, tuple[np.ndarray, ...]] = {}
+
+
+def stacked_policy_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The tables of every registered policy stacked by policy code, for vectorized engines:
+    directions[policy, ...], cumulative probabilities[policy, ..., direction],
+    light change horizons[policy] and whether each policy is deterministic[policy]
+    """
+    num_policies = len(POLICY_TABLES)
+    if num_policies not in _stacked_policy_tables:
+        _stacked_policy_tables.clear()
+        _stacked_policy_tables[num_policies] = (
+            np.stack([policy.directions for policy in POLICY_TABLES]),
+            np.stack([policy.cumulative for policy in POLICY_TABLES]),
+            np.array([policy.light_change_horizon for policy in POLICY_TABLES]),
+            np.array([policy.deterministic for policy in POLICY_TABLES]),
+        )
+    return _stacked_policy_tables[num_policies]
+
+
+def _street_policy(corner, n_s_axis, e_w_axis, avenue_light_is_green, light_changes_soon):
+    # Take the opportunity to cross the avenue along the street while it's green, otherwise walk along the avenue
+    if avenue_light_is_green:
+        preferences = ((e_w_axis, "east", "west"), (n_s_axis, "north", "south"))
+    else:
+        preferences = ((n_s_axis, "north", "south"), (e_w_axis, "east", "west"))
+    for axis, positive, negative in preferences:
+        if axis:
+            return positive if axis > 0 else negative
+
+
+def _avenue_policy(corner, n_s_axis, e_w_axis, avenue_light_is_green, light_changes_soon):
+    # Keep walking N/S along the avenue until reaching the destination street, then turn
+    if n_s_axis == +1 and corner[0] == "n":
+        return "north"
+    if n_s_axis == -1 and corner[0] == "s":
+        return "south"
+    return _street_policy(corner, n_s_axis, e_w_axis, avenue_light_is_green, light_changes_soon)
+
+
+register_policy("street", _street_policy)
+register_policy("avenue", _avenue_policy)
+
+
+# ------------------- Walker -------------------
+
+_RIGHT_TURN = {
+    "east": "south",
+    "south": "west",
+    "west": "north",
+    "north": "east",
+}
+
+_ZIG_ZAG = {
+    "east": "south",
+    "south": "east"
+}
+
+_DIR_DELTA = {
+    "east":  (0, +1),
+    "west":  (0, -1),
+    "south": (+1, 0),
+    "north": (-1, 0),
+}
+
 
 class Walker:
+    # Slotted with integer corner / policy codes so millions of walkers fit in memory.
+    # The string based API (corner, policy, target, destination_corner) is kept as properties.
+    __slots__ = (
+        "id", "street_idx", "avenue_idx", "corner_code", "speed", "grid", "policy_code", "progress",
+        "destination_street_idx", "destination_avenue_idx", "destination_corner_code",
+        "target_street_idx", "target_avenue_idx", "target_corner_code", "rng",
+    )
+
     def __init__(self,
                  walker_id: str,
                  street_idx: int,
@@ -193,7 +505,14 @@ class Walker:
                  speed: float,
                  destination_corner: tuple[int, int, str],
                  policy: str,
-                 grid: CityGrid):
+                 grid: CityGrid,
+                 rng: random.Random = None,
+                 world_time: float = 0.0):
+        """
+        :param rng: generator probabilistic policies draw from, usually shared by every walker
+            of a simulation (see `python_rng`); only deterministic policies may leave it None
+        :param world_time: simulation time the walker leaves at, when it makes its first decision
+        """
         self.id = walker_id
         self.street_idx = street_idx
         self.avenue_idx = avenue_idx
@@ -203,169 +522,236 @@ class Walker:
         self.policy = policy
         self.progress = 0.0
         self.destination_corner = destination_corner
-        self.target = None
-        self._set_next_target(world_time=0)
+        self.rng = rng
+        self._set_next_target(world_time=world_time)
+
+    # String adapters over the integer codes
+    @property
+    def corner(self) -> str:
+        return CORNERS[self.corner_code]
+
+    @corner.setter
+    def corner(self, corner: str):
+        self.corner_code = CORNER_CODES[corner]
+
+    @property
+    def policy(self) -> str:
+        return POLICIES[self.policy_code]
+
+    @policy.setter
+    def policy(self, policy: str):
+        self.policy_code = POLICY_CODES[policy]
+
+    @property
+    def destination_corner(self) -> tuple[int, int, str]:
+        return self.destination_street_idx, self.destination_avenue_idx, CORNERS[self.destination_corner_code]
+
+    @destination_corner.setter
+    def destination_corner(self, destination_corner: tuple[int, int, str]):
+        self.destination_street_idx, self.destination_avenue_idx, corner = destination_corner
+        self.destination_corner_code = CORNER_CODES[corner]
+
+    @property
+    def target(self) -> tuple[int, int, str]:
+        return self.target_street_idx, self.target_avenue_idx, CORNERS[self.target_corner_code]
+
+    @target.setter
+    def target(self, target: tuple[int, int, str]):
+        self.target_street_idx, self.target_avenue_idx, corner = target
+        self.target_corner_code = CORNER_CODES[corner]
+
+    def at_destination(self) -> bool:
+        return (self.corner_code == self.destination_corner_code
+                and self.street_idx == self.destination_street_idx
+                and self.avenue_idx == self.destination_avenue_idx)
 
     def _set_next_target(self, world_time: float):
-        nxt = None
         # Choose the next location based on the walker's policy
         # First, need to find directions required to reach destination
-
-        n_s_axis = None
-        e_w_axis = None
+        # (corner code >> 1 is 0 for "n" corners and 1 for "s", corner code & 1 is 0 for "w" and 1 for "e")
 
         # n_s_axis: +1 if walker should head north, -1 if should head south, 0 if on the correct j axis
-        if self.destination_corner[0] != self.street_idx:
-            n_s_axis = (self.destination_corner[0] - self.street_idx) / abs(self.destination_corner[0] - self.street_idx)
-        elif self.destination_corner[2][0] == self.corner[0]:
+        if self.destination_street_idx != self.street_idx:
+            n_s_axis = 1 if self.destination_street_idx > self.street_idx else -1
+        elif (self.destination_corner_code >> 1) == (self.corner_code >> 1):
             n_s_axis = 0
-        elif self.destination_corner[2][0] == "n":
+        elif (self.destination_corner_code >> 1) == 0:
             n_s_axis = +1
         else:
             n_s_axis = -1
 
         # e_w_axis: +1 if walker should head east, -1 if should head west, 0 if on the correct i axis
-        if self.destination_corner[1] != self.avenue_idx:
-            e_w_axis = (self.destination_corner[1] - self.avenue_idx) / abs(self.destination_corner[1] - self.avenue_idx)
-        elif self.destination_corner[2][1] == self.corner[1]:
+        if self.destination_avenue_idx != self.avenue_idx:
+            e_w_axis = 1 if self.destination_avenue_idx > self.avenue_idx else -1
+        elif (self.destination_corner_code & 1) == (self.corner_code & 1):
             e_w_axis = 0
-        elif self.destination_corner[2][1] == "e":
+        elif (self.destination_corner_code & 1) == 1:
             e_w_axis = +1
         else:
             e_w_axis = -1
 
-        # Observe the traffic light to see which direction
-        intersection_traffic_light_offset = self.grid.traffic_light_grid[(self.avenue_idx, self.street_idx)]
-        avenue_light_is_green = ((world_time + intersection_traffic_light_offset)
-                                 % self.grid.traffic_light_cycle_length
-                                 > self.grid.avenue_traffic_light_cycle_times[0])
-
-        # If policy is 'avenue', then we will continue walking N/S until we hit the destination street or a red light, then turn
-        if self.policy == "avenue":
-
-            # =============================================
-            #         Prefer walking along the avenue
-            # =============================================
-            if n_s_axis == +1 and self.corner[0] == "n":
-                nxt = _CORNER_DELTAS[self.corner]["north"]
-            elif n_s_axis == -1 and self.corner[0] == "s":
-                nxt = _CORNER_DELTAS[self.corner]["south"]
-            # =============================================
-
-            else:
-                nxt = self._next_target_default(avenue_light_is_green, n_s_axis, e_w_axis)
-
-        # If policy is 'street', then we will take the opportunity to cross the avenue along the street if it's green
-        if self.policy == "street":
-
-            nxt = self._next_target_default(avenue_light_is_green, n_s_axis, e_w_axis)
+        # Observe the traffic light and look the decision up in the policy's tables
+        policy = POLICY_TABLES[self.policy_code]
+        light_state = self.grid.avenue_light_is_green(self.avenue_idx, self.street_idx, world_time)
+        if (policy.light_change_horizon
+                and self.grid.time_to_light_change(self.avenue_idx, self.street_idx, world_time) < policy.light_change_horizon):
+            light_state += 2
+        # decision_index, inlined
+        decision = ((self.corner_code * 3 + n_s_axis + 1) * 3 + e_w_axis + 1) * LIGHT_STATES + light_state
+        nxt = policy._moves[decision]
+
+        if nxt is not None and not policy.deterministic:
+            if self.rng is None:
+                raise Exception(f"Walker {self.id} follows the probabilistic policy {policy.name}, give it an rng (see `python_rng`)")
+            draw = self.rng.random()
+            direction = next(d for d, p in enumerate(policy._cumulative[decision]) if draw < p)
+            nxt = _CORNER_MOVES[self.corner_code][direction]
 
         if nxt is None:
             # Stay in place if no neighbor
-            self.target = (self.street_idx, self.avenue_idx, self.corner)
+            self.target_street_idx = self.street_idx
+            self.target_avenue_idx = self.avenue_idx
+            self.target_corner_code = self.corner_code
         else:
-            dj, di, new_corner = nxt
-            j = self.street_idx + dj
-            i = self.avenue_idx + di
-            self.target = (j, i, new_corner)
+            self.target_street_idx = self.street_idx + nxt[0]
+            self.target_avenue_idx = self.avenue_idx + nxt[1]
+            self.target_corner_code = nxt[2]
         self.progress = 0.0
 
-    def _next_target_default(self, avenue_light_is_green, n_s_axis, e_w_axis) -> tuple[int, int, str]:
-        nxt = None
-        if avenue_light_is_green:
-            if e_w_axis == +1:
-                nxt = _CORNER_DELTAS[self.corner]["east"]
-            elif e_w_axis == -1:
-                nxt = _CORNER_DELTAS[self.corner]["west"]
-            elif n_s_axis == +1:
-                nxt = _CORNER_DELTAS[self.corner]["north"]
-            elif n_s_axis == -1:
-                nxt = _CORNER_DELTAS[self.corner]["south"]
-            else:
-                nxt = None
-        elif not avenue_light_is_green:
-            if n_s_axis == +1:
-                nxt = _CORNER_DELTAS[self.corner]["north"]
-            elif n_s_axis == -1:
-                nxt = _CORNER_DELTAS[self.corner]["south"]
-            elif e_w_axis == +1:
-                nxt = _CORNER_DELTAS[self.corner]["east"]
-            elif e_w_axis == -1:
-                nxt = _CORNER_DELTAS[self.corner]["west"]
-            else:
-                nxt = None
-        return nxt
-
-    def update(self, dt: float, world_time: float):
-
-        if self.target == (self.street_idx, self.avenue_idx, self.corner):
-            # If the walker reached their corner, we're done, no updates to do
-            return
-
-        # Need to check if traffic light is green before crossing
-        if (self.target[0] == self.street_idx
-            and self.target[1] == self.avenue_idx
-            and self.progress <= 0.0):
-
-            # Get the avenue traffic light offset time
-            intersection_traffic_light_offset = self.grid.traffic_light_grid[(self.avenue_idx, self.street_idx)]
-            avenue_light_is_green = ((world_time + intersection_traffic_light_offset)
-                                  % self.grid.traffic_light_cycle_length
-                                  > self.grid.avenue_traffic_light_cycle_times[0])
-
-            # Check which crosswalk we're using (represented as "ne", "se", "nw", "sw")
-            if self.corner[0] != self.target[2][0]:
-                # If the first letter is different, then it's a north/south crosswalk (ie. street crosswalk)
-                if avenue_light_is_green:
-                    # If avenue light is green, street light is red, skip update
-                    return
-            elif self.corner[1] != self.target[2][1]:
-                # If the second letter is different, then it's a east/west crosswalk (ie. avenue crosswalk)
-                if not avenue_light_is_green:
-                    # If avenue light is not green, skip update
-                    return
-            else:
-                raise Exception(f"Bad state, corner transition: {self.corner} -> {self.target[2]}")
-
-
-        step = self.speed * dt / max(self.grid.street_spacing, self.grid.avenue_spacing)
-        self.progress += step
+    def update(self, dt: float, world_time: float, telemetry=None) -> bool:
+        """
+        Moves the walker dt seconds along, up to world_time.
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` to record waits and crossings in
+        :return: True if the walker reached its destination in this update, so it reports its arrival only once
+        """
+        if self.target_street_idx == self.street_idx and self.target_avenue_idx == self.avenue_idx:
+            if self.target_corner_code == self.corner_code:
+                # If the walker reached their corner, we're done, no updates to do
+                return False
+
+            # Need to check if traffic light is green before crossing
+            if self.progress <= 0.0:
+                avenue_light_is_green = self.grid.avenue_light_is_green(self.avenue_idx, self.street_idx, world_time)
+
+                # Check which crosswalk we're using
+                if (self.corner_code ^ self.target_corner_code) & 2:
+                    # If the n/s half is different, then it's a north/south crosswalk (ie. street crosswalk)
+                    crosswalk = STREET_CROSSWALK
+                    blocked = avenue_light_is_green
+                else:
+                    # Otherwise it's an east/west crosswalk (ie. avenue crosswalk), blocked unless the avenue light is green
+                    crosswalk = AVENUE_CROSSWALK
+                    blocked = not avenue_light_is_green
+
+                if blocked:
+                    # The walker's light is red, skip update
+                    if telemetry is not None:
+                        telemetry.record_wait(self, crosswalk, dt)
+                    return False
+                if telemetry is not None:
+                    telemetry.record_crossing(self, crosswalk)
+
+        self.progress += self.speed * dt / self.grid.segment_length
         if self.progress >= 1.0:
             # Snap to target corner
-            self.street_idx, self.avenue_idx, self.corner = self.target
+            self.street_idx = self.target_street_idx
+            self.avenue_idx = self.target_avenue_idx
+            self.corner_code = self.target_corner_code
             self._set_next_target(world_time=world_time)
-
-    def to_state(self):
-        j0, i0, c0 = self.street_idx, self.avenue_idx, self.corner
-        j1, i1, c1 = self.target
+            # Policies only stay put at the destination
+            return self.at_destination()
+        return False
+
+    def to_state(self, out: Optional[dict] = None) -> dict:
+        """
+        Snapshot of the walker for the view.
+        :param out: optional dictionary to fill in place instead of allocating a new one
+        """
+        j0, i0, c0 = self.street_idx, self.avenue_idx, CORNERS[self.corner_code]
+        j1, i1, c1 = self.target_street_idx, self.target_avenue_idx, CORNERS[self.target_corner_code]
         x0, y0 = self.grid.corner_xy(j0, i0, c0)
         x1, y1 = self.grid.corner_xy(j1, i1, c1)
         x = x0 + (x1 - x0) * self.progress
         y = y0 + (y1 - y0) * self.progress
-        return {
-            "id": self.id,
-            "x": x,
-            "y": y,
-            "corner": self.corner,
-            "start": (j0, i0, c0),
-            "end": (j1, i1, c1),
-            "destination": self.destination_corner
-        }
+        if out is None:
+            out = {}
+        out["id"] = self.id
+        out["x"] = x
+        out["y"] = y
+        out["corner"] = c0
+        out["start"] = (j0, i0, c0)
+        out["end"] = (j1, i1, c1)
+        out["destination"] = self.destination_corner
+        return out
 
 
 # ------------------- Simulation -------------------
 
-class CitySimulation:
-    def __init__(self, grid: CityGrid, walkers: List[Walker]):
+class WalkerSimulation:
+    """
+    What the simulations stepping `Walker` objects share: the clock, the telemetry and the
+    snapshots for the view. Subclasses implement `step`.
+    """
+    def __init__(self, grid: CityGrid, walkers: List[Walker], telemetry=None):
+        """
+        :param telemetry: optional `src.telemetry.IntersectionTelemetry` for the walkers to record
+            their waits and crossings in, None records nothing
+        """
         self.grid = grid
         self.walkers = walkers
+        self.telemetry = telemetry
         self.time: float = 0.0
-
-    def step(self, dt: float) -> SimulationState:
+        # walker snapshot dicts, reused by every call to `snapshot`
+        self._snapshot_buffer: List[dict] = []
+
+    @profiled("model.snapshot")
+    def snapshot(self) -> SimulationState:
+        """
+        State of the simulation for the view. The walker dicts live in a preallocated
+        buffer that is overwritten by the next snapshot, so copy them if they need to be kept.
+        """
+        buffer = self._snapshot_buffer
+        if len(buffer) != len(self.walkers):
+            del buffer[len(self.walkers):]
+            buffer.extend({} for _ in range(len(self.walkers) - len(buffer)))
+        for w, out in zip(self.walkers, buffer):
+            w.to_state(out)
+        return SimulationState(time=self.time, walkers=buffer)
+
+
+class CitySimulation(WalkerSimulation):
+    """A fixed population of walkers, stepped until they have all reached their destination"""
+    def __init__(self, grid: CityGrid, walkers: List[Walker], telemetry=None):
+        super().__init__(grid, walkers, telemetry)
+        # walker id -> simulation time it arrived at its destination, see `step`
+        self.arrival_times: Dict[str, float] = {w.id: self.time for w in walkers if w.at_destination()}
+        # the walkers still on their way, the only ones `step` updates
+        self._active: List[Walker] = [w for w in walkers if not w.at_destination()]
+
+    @property
+    def num_active(self) -> int:
+        """Number of walkers that haven't reached their destination yet"""
+        return len(self._active)
+
+    @profiled("model.step")
+    def step(self, dt: float, snapshot: bool = True) -> Optional[SimulationState]:
+        """
+        Advances the simulation by dt seconds. A walker that arrives during the step is recorded
+        in `arrival_times` at the time the step started, ie. the sum of the dts of the steps it was
+        still on its way after, and is not updated again.
+        :param snapshot: whether to build and return the state afterwards, skip it when nobody reads it
+        :return: `snapshot()` if requested, otherwise None
+        """
+        start_time = self.time
         self.time += dt
-        for w in self.walkers:
-            w.update(dt, self.time)
-        return SimulationState(
-            time=self.time,
-            walkers=[w.to_state() for w in self.walkers],
-        )
+        arrived = False
+        telemetry = self.telemetry
+        for w in self._active:
+            if w.update(dt, self.time, telemetry):
+                self.arrival_times[w.id] = start_time
+                arrived = True
+        if arrived:
+            self._active = [w for w in self._active if not w.at_destination()]
+        if snapshot:
+            return self.snapshot()
+        return None
@@ -0,0 +1,201 @@
+import json
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Tuple
+
+import numpy as np
+
+from src.analytic import solve_travel_time
+from src.cache import config_cache, result_key
+from src.config import Config
+from src.controller import config_summary
+from src.model import CityGrid
+from src.profiling import span
+
+
+# ------------------- Confidence intervals -------------------
+
+def t_quantile(confidence: float, dof: int) -> float:
+    """
+    Two-sided Student t critical value (eg. 2.262 for 95% confidence and 9 degrees of freedom).
+    Below 5 degrees of freedom, where the expansion below is too far off (11.3 instead of 12.706
+    for 95% and 1 degree of freedom), it is solved from the exact distribution; from 5 up it is
+    the Cornish-Fisher expansion around the normal quantile, within 0.1% of the exact value.
+    """
+    if dof < 5:
+        return _exact_t_quantile(confidence, dof)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    terms = (
+        (z ** 3 + z) / 4,
+        (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+        (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+        (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160,
+    )
+    return z + sum(term / dof ** (k + 1) for k, term in enumerate(terms))
+
+
+def _t_coverage(t: float, dof: int) -> float:
+    # P(|T| < t) for a whole number of degrees of freedom, the closed form in theta = atan(t / sqrt(dof))
+    theta = math.atan(t / math.sqrt(dof))
+    cos = math.cos(theta)
+    if dof % 2:
+        term, total = cos, 0.0
+        for k in range(1, (dof - 1) // 2 + 1):
+            total += term
+            term *= cos * cos * 2 * k / (2 * k + 1)
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+    term, total = 1.0, 0.0
+    for k in range(1, dof // 2 + 1):
+        total += term
+        term *= cos * cos * (2 * k - 1) / (2 * k)
+    return math.sin(theta) * total
+
+
+def _exact_t_quantile(confidence: float, dof: int) -> float:
+    # Bisection on the coverage, which increases with t
+    low, high = 0.0, 1.0
+    while _t_coverage(high, dof) < confidence:
+        low, high = high, 2 * high
+    for _ in range(100):
+        middle = (low + high) / 2
+        if _t_coverage(middle, dof) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+# ------------------- Paired policy comparison -------------------
+
+@dataclass(frozen=True)
+class PolicyComparison:
+    policies: Tuple[str, str]
+    travel_times: np.ndarray   # [run, policy] travel times in seconds, one row per city
+    confidence: float
+    half_width: float          # of the confidence interval on the mean difference
+    stopped: str               # "tolerance", "sign" or "max_runs"
+
+    @property
+    def runs(self) -> int:
+        return len(self.travel_times)
+
+    @property
+    def means(self) -> Tuple[float, float]:
+        return tuple(self.travel_times.mean(axis=0).tolist())
+
+    @property
+    def difference(self) -> float:
+        """Mean of policies[0] - policies[1] over the paired runs"""
+        return float((self.travel_times[:, 0] - self.travel_times[:, 1]).mean())
+
+    @property
+    def interval(self) -> Tuple[float, float]:
+        return self.difference - self.half_width, self.difference + self.half_width
+
+
+def compare_policies(cfg: Config,
+                     policies: Tuple[str, str] = ("street", "avenue"),
+                     tolerance: float = 1.0,
+                     confidence: float = 0.95,
+                     min_runs: int = 10,
+                     max_runs: int = 1000,
+                     batch_size: int = 10,
+                     stop_on_sign: bool = False) -> PolicyComparison:
+    """
+    Monte Carlo comparison of two policies on the trip of `run_simulation`, sampling random
+    cities until the difference is known well enough. Run k is the city of run id
+    `cfg.run_id + k` of `cfg.traffic_light_grid_random_seed`, and both policies walk the
+    same city, so every run is one paired difference and the city-to-city spread cancels out.
+    Travel times come from the exact solver (`solve_travel_time`), ie. the event engine.
+    :param tolerance: stop once the confidence interval on the mean difference is within +- tolerance seconds
+    :param confidence: confidence level of the interval
+    :param min_runs: runs sampled before the interval is first checked
+    :param max_runs: stop after this many runs whatever the interval
+    :param batch_size: runs sampled between checks of the interval
+    :param stop_on_sign: also stop once which policy is faster is settled, ie. once an interval at
+                         confidence 1 - (1 - confidence) / checks excludes 0. The interval is checked up
+                         to `checks` times, so this Bonferroni split keeps the chance of a wrong sign
+                         below 1 - confidence however many of the checks are made
+    :return: the paired travel times and why sampling stopped
+    """
+    if not 2 <= min_runs <= max_runs:
+        raise Exception(f"Need 2 <= min_runs <= max_runs to estimate a confidence interval, got {min_runs} and {max_runs}")
+    start = (0, 0, cfg.walker_starting_corner)
+    destination = (cfg.num_streets - 1, cfg.num_avenues - 1, "nw")
+
+    checks = 1 + math.ceil((max_runs - min_runs) / batch_size)
+    sign_confidence = 1 - (1 - confidence) / checks
+
+    travel_times = []
+    stopped = "max_runs"
+    half_width = math.inf
+    while len(travel_times) < max_runs:
+        batch_end = min(max(len(travel_times) + batch_size, min_runs), max_runs)
+        for k in range(len(travel_times), batch_end):
+            grid = CityGrid(
+                num_streets=cfg.num_streets,
+                num_avenues=cfg.num_avenues,
+                street_block_length=cfg.street_block_length,
+                street_crosswalk_length=cfg.street_crosswalk_length,
+                avenue_block_length=cfg.avenue_block_length,
+                avenue_crosswalk_length=cfg.avenue_crosswalk_length,
+                avenue_traffic_light_cycle_times=cfg.avenue_traffic_light_cycle_times,
+                traffic_light_grid_random_seed=cfg.traffic_light_grid_random_seed,
+                run_id=cfg.run_id + k,
+            )
+            with span("model.solve"):
+                travel_times.append([
+                    solve_travel_time(grid, start, destination, policy, cfg.walker_speed).travel_time for policy in policies
+                ])
+
+        differences = np.subtract(*np.array(travel_times).T)
+        n = len(differences)
+        standard_error = differences.std(ddof=1) / math.sqrt(n)
+        half_width = t_quantile(confidence, n - 1) * standard_error
+        if half_width <= tolerance:
+            stopped = "tolerance"
+            break
+        if stop_on_sign and abs(differences.mean()) > t_quantile(sign_confidence, n - 1) * standard_error:
+            stopped = "sign"
+            break
+
+    return PolicyComparison(
+        policies=tuple(policies),
+        travel_times=np.array(travel_times),
+        confidence=confidence,
+        half_width=float(half_width),
+        stopped=stopped,
+    )
+
+
+# Config fields `compare_policies` never reads: it always solves the whole trip of the two
+# walkers exactly, whatever engine, time step, time limit or demand the config sets
+_COMPARISON_NON_RESULT_FIELDS = frozenset({"engine", "frame_rate", "max_sim_time", "demand_rate"})
+
+
+def run_comparison(cfg: Config, **kwargs) -> str:
+    """
+    `compare_policies` as a JSON line for `run_sweep`, eg.
+    `run_sweep(configs, path, run=functools.partial(run_comparison, tolerance=0.5))`.
+    With `cfg.cache_dir` set, comparisons already in the cache are not run again.
+    """
+    cache = config_cache(cfg)
+    if cache is not None:
+        key = result_key(cfg, "run_comparison", exclude=_COMPARISON_NON_RESULT_FIELDS, **kwargs)
+        return cache.get_or_compute(key, lambda: _run_comparison(cfg, **kwargs))
+    return _run_comparison(cfg, **kwargs)
+
+
+def _run_comparison(cfg: Config, **kwargs) -> str:
+    comparison = compare_policies(cfg, **kwargs)
+    low, high = comparison.interval
+    result = {f"{policy}_policy": mean for policy, mean in zip(comparison.policies, comparison.means)}
+    result |= {
+        "difference": comparison.difference,
+        "difference_low": low,
+        "difference_high": high,
+        "runs": comparison.runs,
+        "stopped": comparison.stopped,
+    }
+    return json.dumps(result | config_summary(cfg))
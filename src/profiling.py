@@ -0,0 +1,274 @@
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ------------------- Spans -------------------
+#
+# A span is a named phase of a run (model step, snapshot, drawing, output...), timed every
+# time it runs while a `Profiler` is enabled. Methods are marked as spans with `@profiled`,
+# which leaves them untouched: `enable` swaps timing wrappers in and `disable` puts the
+# originals back, so a run that isn't profiled pays nothing at all. Coarse blocks that are
+# not methods use `with span(name)`, a no-op when profiling is off.
+
+# (function, span name) of every `@profiled` function, in definition order
+_TARGETS: List[Tuple[Callable, str]] = []
+
+# the enabled profiler, if any
+_active: Optional["Profiler"] = None
+
+
+def profiled(name: str):
+    """
+    Marks a method as span `name`. Works for methods and classmethods, which callers look up
+    through their class; a module function is only timed when called as a module attribute.
+    """
+    def decorate(function):
+        _TARGETS.append((function, name))
+        # Modules imported while a profiler is enabled (eg. lazily) are timed straight away
+        return function if _active is None else _timed(function, name)
+    return decorate
+
+
+@contextmanager
+def span(name: str):
+    """Times the block as span `name` if a profiler is enabled"""
+    if _active is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _active.record(name, time.perf_counter_ns() - start)
+
+
+def _owner(function: Callable):
+    # The class (or module) holding `function`, from its qualified name
+    owner = sys.modules[function.__module__]
+    for attribute in function.__qualname__.split(".")[:-1]:
+        owner = getattr(owner, attribute)
+    return owner
+
+
+def _timed(function: Callable, name: str) -> Callable:
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active.record(name, time.perf_counter_ns() - start)
+    wrapper.__wrapped__ = function
+    wrapper.__name__ = function.__name__
+    wrapper.__qualname__ = function.__qualname__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+def _patch(enabled: bool):
+    for function, name in _TARGETS:
+        owner = _owner(function)
+        attribute = function.__name__
+        current = owner.__dict__.get(attribute) if isinstance(owner, type) else getattr(owner, attribute, None)
+        is_classmethod = isinstance(current, classmethod)
+        if is_classmethod:
+            current = current.__func__
+        if enabled and current is function:
+            replacement = _timed(function, name)
+        elif not enabled and getattr(current, "__wrapped__", None) is function:
+            replacement = function
+        else:
+            continue
+        setattr(owner, attribute, classmethod(replacement) if is_classmethod else replacement)
+
+
+def enable(profiler: "Profiler"):
+    """Starts recording every span into `profiler`"""
+    global _active
+    if _active is not None:
+        raise Exception("A profiler is already enabled")
+    _active = profiler
+    _patch(True)
+    profiler._start()
+
+
+def disable():
+    global _active
+    if _active is None:
+        return
+    _active._stop()
+    _patch(False)
+    _active = None
+
+
+@contextmanager
+def profiling(profiler: Optional["Profiler"]):
+    """Enables `profiler` for the block, or does nothing if it is None"""
+    if profiler is None:
+        yield
+        return
+    enable(profiler)
+    try:
+        yield profiler
+    finally:
+        disable()
+
+
+# ------------------- Statistics -------------------
+
+class SpanStats:
+    """
+    Count, total and max of a span's durations, plus a log-scale histogram for percentiles:
+    8 buckets per power of 2, so percentiles are within about 6%. Histograms of different
+    processes add up exactly, unlike samples.
+    """
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, duration_ns: int):
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        bucket = _bucket(duration_ns)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: "SpanStats"):
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile duration in seconds, q in [0, 100]"""
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(_bucket_value(bucket), self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+
+def _bucket(duration_ns: int) -> int:
+    # Exact below 16ns, then the power of 2 and the next 3 bits
+    if duration_ns < 16:
+        return duration_ns
+    bits = duration_ns.bit_length()
+    return (bits << 3) | ((duration_ns >> (bits - 4)) & 7)
+
+
+def _bucket_value(bucket: int) -> float:
+    # Middle of the bucket's range
+    if bucket < 16:
+        return bucket
+    bits, mantissa = bucket >> 3, bucket & 7
+    return ((8 + mantissa) << (bits - 4)) + (1 << (bits - 4)) / 2
+
+
+class _StatsHolder:
+    # What `pstats.Stats` loads profile data from
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Profiler:
+    """
+    Per span statistics of the runs it is enabled for, and optionally a cProfile of them.
+    Profilers are picklable once disabled, so sweep workers send theirs back to be merged.
+
+        profiler = Profiler()
+        with profiling(profiler):
+            run_simulation(cfg)
+        print(profiler.report())
+    """
+    def __init__(self, cprofile: bool = False):
+        """
+        :param cprofile: also run cProfile while enabled, for a function level breakdown (slower)
+        """
+        self.cprofile = cprofile
+        self.spans: Dict[str, SpanStats] = {}
+        # seconds spent enabled, summed over merged profilers
+        self.wall_time = 0.0
+        # cProfile data, in the `pstats.Stats.stats` format
+        self.function_stats: dict = {}
+        self._started: float = None
+        self._cprofile = None
+
+    def record(self, name: str, duration_ns: int):
+        stats = self.spans.get(name)
+        if stats is None:
+            stats = self.spans[name] = SpanStats()
+        stats.add(duration_ns)
+
+    def _start(self):
+        self._started = time.perf_counter()
+        if self.cprofile:
+            # Imported here so that span-only profiling never loads it
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.create_stats()
+            self._merge_function_stats(self._cprofile.stats)
+            self._cprofile = None
+        self.wall_time += time.perf_counter() - self._started
+        self._started = None
+
+    def _merge_function_stats(self, function_stats: dict):
+        import pstats
+        if not self.function_stats:
+            self.function_stats = dict(function_stats)
+            return
+        merged = pstats.Stats(_StatsHolder(self.function_stats))
+        merged.add(_StatsHolder(function_stats))
+        self.function_stats = merged.stats
+
+    def merge(self, other: "Profiler"):
+        """Adds another profiler's results, eg. a sweep worker's"""
+        for name, stats in other.spans.items():
+            self.spans.setdefault(name, SpanStats()).merge(stats)
+        self.wall_time += other.wall_time
+        if other.function_stats:
+            self._merge_function_stats(other.function_stats)
+
+    def report(self) -> str:
+        """Table of every span: count, total seconds, share of the profiled time and percentiles"""
+        lines = [f"{'span':22s} {'count':>10s} {'total':>9s} {'%':>6s} {'mean':>9s} "
+                 f"{'p50':>9s} {'p90':>9s} {'p99':>9s} {'max':>9s}"]
+        for name, stats in sorted(self.spans.items(), key=lambda item: -item[1].total_ns):
+            total = stats.total_ns / 1e9
+            share = 100 * total / self.wall_time if self.wall_time else 0.0
+            lines.append(
+                f"{name:22s} {stats.count:10d} {_duration(total):>9s} {share:6.1f} {_duration(total / stats.count):>9s} "
+                + " ".join(f"{_duration(stats.percentile(q)):>9s}" for q in (50, 90, 99))
+                + f" {_duration(stats.max_ns / 1e9):>9s}"
+            )
+        lines.append(f"profiled {self.wall_time:.3f}s; spans nest (model.step includes a snapshot it builds), so shares can add up to more than 100%")
+        return "\n".join(lines)
+
+    def dump_stats(self, path: str):
+        """Writes the cProfile data as a pstats file, eg. for `python -m pstats` or snakeviz"""
+        if not self.function_stats:
+            raise Exception("No cProfile data, create the Profiler with cprofile=True")
+        import pstats
+        pstats.Stats(_StatsHolder(self.function_stats)).dump_stats(path)
+
+
+def _duration(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
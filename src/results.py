@@ -0,0 +1,261 @@
+import csv
+import importlib.util
+import itertools
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Sequence
+
+from src.files import replace_atomically
+from src.profiling import profiled
+
+# ------------------- Dataset layout -------------------
+#
+# A results dataset is a directory of immutable part files, hive-style partitioned:
+#
+#   results/_schema.json
+#   results/green_time=10/red_time=15/part-<time>-<pid>-<n>.parquet   (or .csv)
+#
+# `_schema.json` records the file format and the type of every column. Every flush adds
+# new part files and never touches existing ones, so appending to a dataset (eg. resuming a
+# sweep) is just writing more parts. Partition columns are stored in the directory names
+# only, so keep them to a few low-cardinality config fields.
+
+SCHEMA_FILE = "_schema.json"
+
+# Column types, narrowest first: a column holding several of them gets the widest
+COLUMN_TYPES = ("bool", "int64", "float64", "string")
+
+_PYTHON_TYPES = {bool: "bool", int: "int64", float: "float64", type(None): COLUMN_TYPES[0]}
+
+# pandas dtypes of loaded columns, without / with missing values
+_PANDAS_TYPES = {"bool": "bool", "int64": "int64", "float64": "float64", "string": "object"}
+_NULLABLE_PANDAS_TYPES = {"bool": "boolean", "int64": "Int64", "float64": "float64", "string": "object"}
+
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _column_type(values: list) -> str:
+    # Looks at the set of Python types in the column, not at every value
+    return _widest(*(_PYTHON_TYPES.get(value_type, "string") for value_type in set(map(type, values))))
+
+
+def _widest(*column_types: str) -> str:
+    return max(column_types, key=COLUMN_TYPES.index)
+
+
+def _read_schema(path: str):
+    schema_path = os.path.join(path, SCHEMA_FILE)
+    if not os.path.exists(schema_path):
+        return None
+    with open(schema_path) as file:
+        return json.load(file)
+
+
+# ------------------- Writer -------------------
+
+class ResultsSink:
+    """
+    Buffers result rows in memory and flushes them as typed columnar part files:
+    Parquet when pyarrow is installed, CSV otherwise. Opening an existing dataset appends to it.
+
+        with ResultsSink("experiment/results", partition_by=("green_time", "red_time")) as sink:
+            sink.append(json.loads(run_simulation(cfg)))
+    """
+    def __init__(self,
+                 path: str,
+                 partition_by: Sequence[str] = (),
+                 buffer_rows: int = 1 << 16,
+                 file_format: str = None,
+                 flush_seconds: float = None):
+        """
+        :param path: dataset directory, created if needed
+        :param partition_by: columns whose values name the partition directories
+        :param buffer_rows: rows held in memory before they are flushed
+        :param flush_seconds: also flush rows once the oldest has been buffered this long, None = never
+        :param file_format: "parquet" or "csv"; by default an existing dataset's format,
+            else parquet if pyarrow is installed
+        """
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.flush_seconds = flush_seconds
+        self.rows_written = 0
+        self._rows: List[dict] = []
+        # time.monotonic() when the oldest buffered row was appended
+        self._buffered_since: float = None
+        self._parts_written = 0
+
+        schema = _read_schema(path)
+        if schema is None:
+            schema = {
+                "format": file_format or ("parquet" if parquet_available() else "csv"),
+                "partition_by": list(partition_by),
+                "columns": {},
+            }
+        elif file_format and file_format != schema["format"]:
+            raise Exception(f"{path} holds {schema['format']} results, can't append {file_format}")
+        elif partition_by and list(partition_by) != schema["partition_by"]:
+            raise Exception(f"{path} is partitioned by {schema['partition_by']}, not {list(partition_by)}")
+        if schema["format"] == "parquet" and not parquet_available():
+            raise Exception(f"{path} holds parquet results, install pyarrow to append to it")
+        self.schema = schema
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, row: dict):
+        if not self._rows:
+            self._buffered_since = time.monotonic()
+        self._rows.append(row)
+        if (len(self._rows) >= self.buffer_rows
+                or (self.flush_seconds is not None and time.monotonic() - self._buffered_since >= self.flush_seconds)):
+            self.flush()
+
+    def extend(self, rows: Iterable[dict]):
+        for row in rows:
+            self.append(row)
+
+    @profiled("output.results")
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+
+        partition_by = self.schema["partition_by"]
+        partitions: Dict[tuple, List[dict]] = {}
+        for row in rows:
+            partitions.setdefault(tuple(row.get(column) for column in partition_by), []).append(row)
+
+        # Columns of every partition, in first-seen order
+        column_names = list(self.schema["columns"])
+        column_names += [column for column in dict.fromkeys(itertools.chain.from_iterable(rows)) if column not in self.schema["columns"]]
+        partition_data = {
+            values: {column: [row.get(column) for row in partition_rows] for column in column_names if column not in partition_by}
+            for values, partition_rows in partitions.items()
+        }
+
+        # Type every column, widening the schema if this batch needs it
+        column_types = dict(self.schema["columns"])
+        for column in column_names:
+            if column in partition_by:
+                batch_types = [_column_type([values[partition_by.index(column)] for values in partition_data])]
+            else:
+                batch_types = [_column_type(data[column]) for data in partition_data.values()]
+            column_types[column] = _widest(column_types.get(column, COLUMN_TYPES[0]), *batch_types)
+        if column_types != self.schema["columns"]:
+            self.schema["columns"] = column_types
+            os.makedirs(self.path, exist_ok=True)
+            replace_atomically(os.path.join(self.path, SCHEMA_FILE),
+                                lambda tmp_path: _write_json(tmp_path, self.schema))
+
+        columns = [column for column in column_types if column not in partition_by]
+        for values, data in partition_data.items():
+            directory = os.path.join(self.path, *(f"{column}={value}" for column, value in zip(partition_by, values)))
+            os.makedirs(directory, exist_ok=True)
+            name = f"part-{time.time_ns()}-{os.getpid()}-{self._parts_written}.{self.schema['format']}"
+            self._parts_written += 1
+            if self.schema["format"] == "parquet":
+                write = lambda tmp_path: _write_parquet(tmp_path, data, {c: column_types[c] for c in columns})
+            else:
+                write = lambda tmp_path: _write_csv(tmp_path, data)
+            replace_atomically(os.path.join(directory, name), write)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self.flush()
+
+
+def _write_json(path: str, value):
+    with open(path, "w") as file:
+        json.dump(value, file, indent=2)
+
+
+def _write_csv(path: str, data: Dict[str, list]):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(data)
+        writer.writerows(zip(*data.values()))
+
+
+def _write_parquet(path: str, data: Dict[str, list], column_types: Dict[str, str]):
+    # Imported here so that CSV datasets never load pyarrow
+    import pyarrow
+    import pyarrow.parquet
+
+    arrow_types = {"bool": pyarrow.bool_(), "int64": pyarrow.int64(), "float64": pyarrow.float64(), "string": pyarrow.string()}
+    schema = pyarrow.schema([(column, arrow_types[column_types[column]]) for column in data])
+    pyarrow.parquet.write_table(pyarrow.Table.from_pydict(data, schema=schema), path)
+
+
+# ------------------- Reader -------------------
+
+def load_results(path: str, columns: Sequence[str] = None):
+    """
+    Reads a whole results dataset into one pandas DataFrame, with the column types of its schema
+    :param path: dataset directory written by `ResultsSink`
+    :param columns: only read these columns (partition columns are always cheap)
+    """
+    # Imported here so that writing results never loads pandas
+    import pandas as pd
+
+    schema = _read_schema(path)
+    if schema is None:
+        raise Exception(f"{path} is not a results dataset (no {SCHEMA_FILE})")
+    column_types = schema["columns"]
+    partition_by = schema["partition_by"]
+    wanted = list(columns) if columns is not None else list(column_types)
+    file_columns = [column for column in wanted if column not in partition_by]
+    suffix = f".{schema['format']}"
+    if schema["format"] == "parquet":
+        import pyarrow.parquet
+
+    frames = []
+    for directory, _, files in sorted(os.walk(path)):
+        parts = sorted(name for name in files if name.startswith("part-") and name.endswith(suffix))
+        if not parts:
+            continue
+        # Partition values from the directory names
+        partition = dict(
+            segment.split("=", 1) for segment in os.path.relpath(directory, path).split(os.sep) if "=" in segment
+        )
+        for name in parts:
+            part_path = os.path.join(directory, name)
+            if schema["format"] == "parquet":
+                # Only read the wanted columns this part has, from its footer
+                part_columns = set(pyarrow.parquet.read_schema(part_path).names)
+                frame = pd.read_parquet(part_path, columns=[column for column in file_columns if column in part_columns])
+            else:
+                # Only pin the types pandas could guess wrong, ints and bools are converted below
+                frame = pd.read_csv(
+                    part_path,
+                    usecols=lambda column: column in file_columns,
+                    dtype={c: _PANDAS_TYPES[column_types[c]] for c in file_columns if column_types[c] in ("float64", "string")},
+                    float_precision="round_trip",
+                )
+            # Columns added to the schema after this part was written are missing from it
+            frame = frame.reindex(columns=file_columns)
+            for column in partition_by:
+                if column in wanted:
+                    frame[column] = partition[column]
+            frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame({column: pd.Series(dtype=_PANDAS_TYPES[column_types[column]]) for column in wanted})
+    frame = pd.concat(frames, ignore_index=True)[wanted]
+    for column in wanted:
+        if column in partition_by:
+            values = frame[column].replace("None", None)
+            if column_types[column] == "bool":
+                values = values.map({"True": True, "False": False, None: None})
+            elif column_types[column] != "string":
+                values = pd.to_numeric(values)
+            frame[column] = values
+        # numpy dtypes unless the column has missing values
+        missing = frame[column].isna().any()
+        frame[column] = frame[column].astype((_NULLABLE_PANDAS_TYPES if missing else _PANDAS_TYPES)[column_types[column]])
+    return frame
@@ -0,0 +1,199 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+from src.analytic import solve_travel_time
+from src.model import CityGrid, AVENUE_CROSSWALK, CORNERS, CORNER_CODES, STREET_CROSSWALK, _CORNER_MOVES
+
+# ------------------- Corner graph -------------------
+#
+# Nodes are corners, numbered node = (street_idx * num_avenues + avenue_idx) * 4 + corner_code,
+# with one edge per direction out of `_CORNER_MOVES`. Every edge is one move of
+# `segment_length / speed` seconds; block moves can be taken at any time, crosswalk moves
+# only while their light is green. Waiting at a light is FIFO (leaving later never
+# arrives earlier), so Dijkstra on earliest arrival times is exact.
+
+# Kind of a move along a block, crosswalk moves are STREET_CROSSWALK or AVENUE_CROSSWALK
+BLOCK = -1
+
+# _MOVE_KIND[corner_code][dir_code]
+_MOVE_KIND = np.array([
+    [
+        BLOCK if dj or di else STREET_CROSSWALK if (corner_code ^ new_corner_code) & 2 else AVENUE_CROSSWALK
+        for dj, di, new_corner_code in moves
+    ]
+    for corner_code, moves in enumerate(_CORNER_MOVES)
+], dtype=np.int8)
+# _BLOCKED[avenue_light_is_green * 4 + corner_code][dir_code]: the move has to wait for its light.
+# A street crosswalk needs the avenue light to be red, an avenue crosswalk needs it green.
+_BLOCKED = np.concatenate((_MOVE_KIND == AVENUE_CROSSWALK, _MOVE_KIND == STREET_CROSSWALK))
+
+
+@dataclass(frozen=True)
+class Route:
+    departure_time: float
+    arrival_time: float
+    corners: Tuple[tuple[int, int, str], ...]   # (street_idx, avenue_idx, corner), start to destination
+
+    @property
+    def travel_time(self) -> float:
+        return self.arrival_time - self.departure_time
+
+
+class RouteOracle:
+    """
+    Time-dependent shortest paths over the corner graph of a `CityGrid`: the best
+    achievable arrival time from any corner and departure time, for a walker free to
+    pick any route. The adjacency index is built once per oracle, so reuse one oracle
+    for every query on the same grid and speed.
+
+    Every edge takes at least `segment_time`, so each round of the search settles every
+    open corner reached within `segment_time` of the earliest one at once (nothing
+    later can improve on them) and relaxes all of their edges as numpy arrays. A query
+    takes about travel_time / segment_time rounds, whatever the size of the grid.
+    """
+    def __init__(self, grid: CityGrid, speed: float):
+        self.grid = grid
+        self.speed = speed
+        self.segment_time = grid.segment_length / speed
+        self.num_nodes = grid.num_streets * grid.num_avenues * len(CORNERS)
+
+        # Adjacency index: neighbors[node, dir_code] is the node the move leads to. Moves off
+        # the grid lead to an extra node `num_nodes`, which the search never walks to.
+        dj, di, new_corner_code = (
+            np.array([[move[k] for move in moves] for moves in _CORNER_MOVES]) for k in range(3)
+        )
+        intersection, corner_code = np.divmod(np.arange(self.num_nodes), len(CORNERS))
+        street_idx, avenue_idx = np.divmod(intersection, grid.num_avenues)
+        next_street_idx = street_idx[:, None] + dj[corner_code]
+        next_avenue_idx = avenue_idx[:, None] + di[corner_code]
+        on_grid = ((0 <= next_street_idx) & (next_street_idx < grid.num_streets)
+                   & (0 <= next_avenue_idx) & (next_avenue_idx < grid.num_avenues))
+        neighbors = (next_street_idx * grid.num_avenues + next_avenue_idx) * len(CORNERS) + new_corner_code[corner_code]
+        self.neighbors = np.where(on_grid, neighbors, self.num_nodes).astype(np.int32)
+
+        # Light offsets by intersection index, street_idx * num_avenues + avenue_idx
+        self._offsets = np.ascontiguousarray(grid.traffic_light_offsets.T).ravel()
+
+    def node(self, street_idx: int, avenue_idx: int, corner: str) -> int:
+        return (street_idx * self.grid.num_avenues + avenue_idx) * len(CORNERS) + CORNER_CODES[corner]
+
+    def corner(self, node: int) -> tuple[int, int, str]:
+        intersection, corner_code = divmod(int(node), len(CORNERS))
+        street_idx, avenue_idx = divmod(intersection, self.grid.num_avenues)
+        return street_idx, avenue_idx, CORNERS[corner_code]
+
+    def earliest_arrival(self,
+                         start: tuple[int, int, str],
+                         destination: tuple[int, int, str],
+                         departure_time: float = 0.0) -> Route:
+        """
+        :param start: (street_idx, avenue_idx, corner) to leave from
+        :param destination: (street_idx, avenue_idx, corner) to reach
+        :param departure_time: simulation time of leaving `start`
+        :return: the fastest route and its arrival time
+        """
+        target_node = self.node(*destination)
+        arrival_times, parents = self._search(self.node(*start), departure_time, target_node)
+
+        path = [target_node]
+        while path[-1] != parents[path[-1]]:
+            path.append(int(parents[path[-1]]))
+        return Route(
+            departure_time=departure_time,
+            arrival_time=float(arrival_times[target_node]),
+            corners=tuple(self.corner(node) for node in reversed(path)),
+        )
+
+    def arrival_times(self, start: tuple[int, int, str], departure_time: float = 0.0) -> np.ndarray:
+        """
+        Earliest arrival time at every corner, shaped [street, avenue, corner_code]
+        :param start: (street_idx, avenue_idx, corner) to leave from
+        :param departure_time: simulation time of leaving `start`
+        """
+        arrival_times, _ = self._search(self.node(*start), departure_time)
+        return arrival_times.reshape(self.grid.num_streets, self.grid.num_avenues, len(CORNERS))
+
+    def _search(self, start_node: int, departure_time: float, target_node: int = -1):
+        cycle_length = self.grid.traffic_light_cycle_length
+        green_time = self.grid.avenue_traffic_light_cycle_times[0]
+        segment_time = self.segment_time
+
+        # One extra entry for the off-grid node, "reached" before anything else so it is never improved
+        arrival_times = np.full(self.num_nodes + 1, np.inf)
+        arrival_times[-1] = -np.inf
+        parents = np.full(self.num_nodes + 1, -1, dtype=np.int32)
+        settled = np.zeros(self.num_nodes + 1, dtype=bool)
+        last_move = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        arrival_times[start_node] = departure_time
+        parents[start_node] = start_node
+
+        # Corners reached but not settled yet, bucketed by (arrival_time - departure_time) // segment_time.
+        # A bucket only holds corners within `segment_time` of each other, and its corners
+        # can only improve corners in later buckets, so a whole bucket settles at once.
+        buckets = {0: [np.array([start_node], dtype=np.int32)]}
+
+        while buckets:
+            bucket = min(buckets)
+            nodes = np.concatenate(buckets.pop(bucket))
+            # Corners settled from an earlier bucket are stale entries
+            nodes = nodes[~settled[nodes]]
+            if not len(nodes):
+                continue
+            settled[nodes] = True
+            if target_node >= 0 and settled[target_node]:
+                break
+
+            world_time = arrival_times[nodes]
+            phase = (world_time + self._offsets[nodes >> 2]) % cycle_length
+            avenue_light_is_green = phase > green_time
+            blocked = _BLOCKED[(avenue_light_is_green << 2) | (nodes & 3)]
+            time_to_light_change = np.where(avenue_light_is_green, cycle_length - phase, green_time - phase)
+            next_times = (world_time + segment_time)[:, None] + blocked * time_to_light_change[:, None]
+
+            next_nodes = self.neighbors[nodes]
+            rows, cols = np.nonzero(next_times < arrival_times[next_nodes])
+            next_nodes, next_times, blocked = next_nodes[rows, cols], next_times[rows, cols], blocked[rows, cols]
+            # Several moves can improve the same corner; every corner keeps one move, the earliest
+            order = np.arange(len(next_nodes))
+            last_move[next_nodes] = order
+            kept = last_move[next_nodes]
+            if (kept != order).any():
+                while True:
+                    beaten = next_times < next_times[kept]
+                    if not beaten.any():
+                        break
+                    last_move[next_nodes[beaten]] = order[beaten]
+                    kept = last_move[next_nodes]
+                kept = kept == order
+                rows, next_nodes, next_times, blocked = rows[kept], next_nodes[kept], next_times[kept], blocked[kept]
+            arrival_times[next_nodes] = next_times
+            parents[next_nodes] = nodes[rows]
+
+            # Walking straight on lands in the next bucket, waiting at a light anywhere after it
+            buckets.setdefault(bucket + 1, []).append(next_nodes[~blocked])
+            if blocked.any():
+                waiting_buckets = np.maximum((next_times[blocked] - departure_time) // segment_time, bucket + 1)
+                order = np.argsort(waiting_buckets)
+                waiting_buckets, first = np.unique(waiting_buckets[order], return_index=True)
+                for b, chunk in zip(waiting_buckets.tolist(), np.split(next_nodes[blocked][order], first[1:])):
+                    buckets.setdefault(int(b), []).append(chunk)
+
+        if target_node >= 0 and not settled[target_node]:
+            raise Exception(f"{self.corner(target_node)} is not reachable from {self.corner(start_node)}")
+        return arrival_times[:-1], parents[:-1]
+
+
+def policy_regret(grid: CityGrid,
+                  start: tuple[int, int, str],
+                  destination: tuple[int, int, str],
+                  policy: str,
+                  speed: float,
+                  departure_time: float = 0.0,
+                  oracle: RouteOracle = None) -> float:
+    """Seconds a policy loses against the best achievable route for the same trip"""
+    oracle = oracle or RouteOracle(grid, speed)
+    best = oracle.earliest_arrival(start, destination, departure_time)
+    achieved = solve_travel_time(grid, start, destination, policy, speed, departure_time)
+    return achieved.arrival_time - best.arrival_time
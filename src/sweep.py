@@ -0,0 +1,189 @@
+import itertools
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import replace
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from src.cache import result_key
+from src.config import Config
+from src.controller import run_simulation
+from src.profiling import Profiler, profiling
+from src.results import ResultsSink, load_results, SCHEMA_FILE
+
+
+# ------------------- Parameter grid -------------------
+
+def expand_grid(base: Config, parameter_grid: Dict[str, Sequence]) -> Iterator[Config]:
+    """
+    Expands a declarative parameter grid into one config per combination.
+    :param base: config providing every field that is not swept
+    :param parameter_grid: Dictionary
+        keys: str, name of a `Config` field
+        values: sequence of values to sweep that field over (the cartesian product is taken)
+    :return: Iterator of configs
+    """
+    names = list(parameter_grid)
+    for values in itertools.product(*(parameter_grid[name] for name in names)):
+        yield replace(base, **dict(zip(names, values)))
+
+
+# Column holding the `run_key` of every result row
+KEY_COLUMN = "result_key"
+
+
+def run_key(run: Callable[[Config], str], cfg: Config) -> str:
+    """
+    Key identifying the result of `run(cfg)`: the `result_key` of every config field that affects it,
+    of the run function and of the keyword arguments bound to it with `functools.partial`
+    """
+    params = {}
+    while isinstance(run, partial):
+        if run.args:
+            raise Exception("Bind the arguments of a sweep's run function by keyword, so that they key its results")
+        params = run.keywords | params
+        run = run.func
+    return result_key(cfg, run.__name__, **params)
+
+
+def completed_keys(output_path: str) -> set[str]:
+    """
+    Keys of the runs already written to `output_path`, a .jsonl file (ignores a truncated
+    last line) or a `ResultsSink` dataset directory
+    """
+    keys = set()
+    if not os.path.exists(output_path):
+        return keys
+    if os.path.isdir(output_path):
+        if not os.path.exists(os.path.join(output_path, SCHEMA_FILE)):
+            return keys
+        try:
+            frame = load_results(output_path, columns=[KEY_COLUMN])
+        except KeyError:
+            # written before rows were keyed, so none of its runs match
+            return keys
+        keys.update(frame[KEY_COLUMN].dropna())
+        return keys
+    with open(output_path) as file:
+        for line in file:
+            try:
+                keys.add(json.loads(line)[KEY_COLUMN])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return keys
+
+
+# ------------------- Runner -------------------
+
+# Longest a dataset sweep holds finished rows in memory, bounding what killing it loses
+FLUSH_SECONDS = 30.0
+
+def _run_chunk(run: Callable[[Config], str], chunk: List[Tuple[str, Config]], profile: bool = False, cprofile: bool = False):
+    """The (key, result line) of every (key, config) of the chunk, and its worker's `Profiler` if `profile` is set"""
+    profiler = Profiler(cprofile=cprofile) if profile else None
+    with profiling(profiler):
+        lines = [(key, run(cfg)) for key, cfg in chunk]
+    return lines, profiler
+
+
+def run_sweep(configs: Iterable[Config],
+              output_path: str,
+              max_workers: int = None,
+              chunk_size: int = 8,
+              run: Callable[[Config], str] = run_simulation,
+              partition_by: Sequence[str] = (),
+              profiler: Profiler = None) -> int:
+    """
+    Runs every config in STATISTICS mode over a process pool and appends its result row
+    to `output_path` as its chunk finishes, with its `run_key` in the KEY_COLUMN column.
+    Configs whose key is already there are skipped, so an interrupted sweep resumes where
+    it stopped, and configs with the same key only run once.
+    :param configs: configs to run, with output_mode STATISTICS
+    :param output_path: a .jsonl file, one JSON line per run, flushed as each chunk finishes;
+        otherwise a `ResultsSink` dataset directory, flushed every `ResultsSink.buffer_rows` rows
+        or FLUSH_SECONDS, whichever comes first, so part files stay large. Killing a sweep loses
+        the runs in flight and not yet flushed, which the next sweep runs again
+    :param max_workers: number of worker processes, defaults to the number of cores
+    :param chunk_size: number of configs sent to a worker per task
+    :param run: picklable function running one config and returning its JSON line, defaults to
+        `run_simulation`; bind its options with `functools.partial`
+    :param partition_by: result columns to partition a new dataset directory by
+    :param profiler: profile every run in the workers and the writing of their results here,
+        and merge it all into this (with cProfile too if `profiler.cprofile` is set)
+    :return: number of runs written
+    """
+    done = completed_keys(output_path)
+    pending = {}
+    for cfg in configs:
+        key = run_key(run, cfg)
+        if key not in done:
+            pending.setdefault(key, cfg)
+    pending = list(pending.items())
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = (pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size))
+    written = 0
+
+    if output_path.endswith(".jsonl"):
+        output = _JsonLinesOutput(output_path)
+    else:
+        output = ResultsSink(output_path, partition_by=partition_by, flush_seconds=FLUSH_SECONDS)
+
+    with output, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Keep a bounded number of chunks in flight and stream results as they complete
+        in_flight = set()
+        for chunk in chunks:
+            in_flight.add(executor.submit(_run_chunk, run, chunk, profiler is not None, profiler is not None and profiler.cprofile))
+            if len(in_flight) >= 2 * max_workers:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                written += _write_results(output, finished, profiler)
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            written += _write_results(output, finished, profiler)
+
+    return written
+
+
+def _write_results(output, futures, profiler: Profiler = None) -> int:
+    lines = []
+    for future in futures:
+        chunk_lines, worker_profiler = future.result()
+        if profiler is not None:
+            profiler.merge(worker_profiler)
+        lines += chunk_lines
+    # Writing the results is the parent's share of the work, profiled like the runs
+    with profiling(profiler):
+        for key, line in lines:
+            output.append(json.loads(line) | {KEY_COLUMN: key})
+        if isinstance(output, _JsonLinesOutput):
+            output.flush()
+    return len(lines)
+
+
+class _JsonLinesOutput:
+    """Appends result rows to a .jsonl file, the same interface as `ResultsSink`"""
+    def __init__(self, path: str):
+        self.file = open(path, "a+")
+        # Start on a fresh line if the previous sweep died mid-write
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, row: dict):
+        self.file.write(json.dumps(row))
+        self.file.write("\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,117 @@
+import numpy as np
+
+from src.model import CityGrid, CROSSWALKS
+
+# ------------------- Intersection counters -------------------
+
+
+class IntersectionTelemetry:
+    """
+    Wait time, red light and crossing counters of every crosswalk, filled in by the engines as
+    they run (pass one as `telemetry` to `CitySimulation`, `BatchSimulation`, `EventSimulation` or
+    `DemandSimulation`; without one they record nothing). Every array is preallocated and
+    indexed [avenue_idx, street_idx, crosswalk] like `CityGrid.traffic_light_offsets`, see `src.model.CROSSWALKS`.
+
+    The tick engines record waits in whole steps, the event engine records them exactly.
+    """
+    def __init__(self, grid: CityGrid):
+        shape = (grid.num_avenues, grid.num_streets, len(CROSSWALKS))
+        # seconds walkers spent waiting for a green light
+        self.wait_time = np.zeros(shape)
+        # number of waits, ie. walkers that reached the crosswalk on a red light
+        self.red_light_hits = np.zeros(shape, dtype=np.int64)
+        # number of walkers that stepped onto the crosswalk
+        self.crossings = np.zeros(shape, dtype=np.int64)
+        # walkers currently waiting, so every wait is one red light hit:
+        # Walker objects for the scalar engines, a mask over the walkers for the batch engine
+        self._waiting = set()
+        self._batch_waiting: np.ndarray = None
+
+    def __iadd__(self, other: "IntersectionTelemetry"):
+        """Adds up the counters of another run on the same grid size"""
+        self.wait_time += other.wait_time
+        self.red_light_hits += other.red_light_hits
+        self.crossings += other.crossings
+        return self
+
+    def mean_wait(self) -> np.ndarray:
+        """Mean wait per crossing of every crosswalk, 0 where nobody crossed"""
+        return np.divide(self.wait_time, self.crossings, out=np.zeros_like(self.wait_time), where=self.crossings > 0)
+
+    # Scalar engines, one walker at a time
+
+    def record_wait(self, walker, crosswalk: int, wait: float):
+        """`walker` spent `wait` more seconds at a red light in front of `crosswalk`"""
+        self.wait_time[walker.avenue_idx, walker.street_idx, crosswalk] += wait
+        if walker not in self._waiting:
+            self._waiting.add(walker)
+            self.red_light_hits[walker.avenue_idx, walker.street_idx, crosswalk] += 1
+
+    def record_crossing(self, walker, crosswalk: int):
+        """`walker` stepped onto `crosswalk`"""
+        self._waiting.discard(walker)
+        self.crossings[walker.avenue_idx, walker.street_idx, crosswalk] += 1
+
+    # Batch engine
+
+    def record_batch(self, batch, idx: np.ndarray, crosswalk: np.ndarray, blocked: np.ndarray, dt: float):
+        """
+        The walkers `idx` of a `WalkerBatch` were in front of a crosswalk for a step of dt seconds.
+        :param crosswalk: crosswalk of every walker in `idx`
+        :param blocked: mask of the walkers in `idx` that waited for their light, the others crossed
+        """
+        if self._batch_waiting is None or self._batch_waiting.size != len(batch):
+            self._batch_waiting = np.zeros(len(batch), dtype=bool)
+        intersection = (batch.avenue_idx[idx], batch.street_idx[idx], crosswalk)
+        hit = blocked & ~self._batch_waiting[idx]
+        np.add.at(self.wait_time, tuple(axis[blocked] for axis in intersection), dt)
+        np.add.at(self.red_light_hits, tuple(axis[hit] for axis in intersection), 1)
+        np.add.at(self.crossings, tuple(axis[~blocked] for axis in intersection), 1)
+        self._batch_waiting[idx] = blocked
+
+    # Export
+
+    def save(self, path: str):
+        """
+        Saves the counters as a heatmap image, or as the raw arrays if `path` ends in ".npz"
+        (reload those with `np.load`)
+        """
+        if path.endswith(".npz"):
+            np.savez(path, wait_time=self.wait_time, red_light_hits=self.red_light_hits,
+                     crossings=self.crossings, crosswalks=np.array(CROSSWALKS))
+        else:
+            save_heatmaps(self, path)
+
+
+def save_heatmaps(telemetry: IntersectionTelemetry, path: str):
+    """
+    One heatmap per counter and crosswalk, avenues along x and streets along y (north up).
+    The image format follows the extension of `path`, eg. ".png" or ".pdf".
+    """
+    # Imported here so that the engines never load matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    counters = (
+        ("wait time (s)", telemetry.wait_time),
+        ("red light hits", telemetry.red_light_hits),
+        ("crossings", telemetry.crossings),
+        ("mean wait per crossing (s)", telemetry.mean_wait()),
+    )
+    num_avenues, num_streets, _ = telemetry.wait_time.shape
+    panel_width, panel_height = max(5.0, 0.15 * num_avenues), max(2.5, 0.15 * num_streets)
+    figure, axes = plt.subplots(len(counters), len(CROSSWALKS), squeeze=False,
+                                figsize=(panel_width * len(CROSSWALKS), panel_height * len(counters)))
+    for row, (title, values) in enumerate(counters):
+        for crosswalk, name in enumerate(CROSSWALKS):
+            ax = axes[row, crosswalk]
+            # [avenue, street] -> image rows of streets, street 0 (the southmost) at the bottom
+            image = ax.imshow(values[:, :, crosswalk].T, origin="lower", aspect="auto", cmap="viridis")
+            ax.set_title(f"{name} crosswalks: {title}", fontsize=10)
+            ax.set_xlabel("avenue")
+            ax.set_ylabel("street")
+            figure.colorbar(image, ax=ax)
+    figure.tight_layout()
+    figure.savefig(path)
+    plt.close(figure)
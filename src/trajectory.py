@@ -0,0 +1,262 @@
+import bisect
+import json
+import os
+import queue
+import struct
+import threading
+from typing import List
+
+import numpy as np
+
+from src.batch import WalkerBatch
+from src.model import CityGrid, Walker, CORNERS, SimulationState
+from src.profiling import profiled
+
+# ------------------- File format -------------------
+#
+# MAGIC | uint32 header length | JSON header | traffic light offsets | records ...
+#
+# The JSON header describes the grid and the layout of the rest of the file. The
+# offsets are a float64 array shaped like `CityGrid.traffic_light_offsets`, and the
+# records are fixed-size rows of RECORD_DTYPE (one row per walker per frame, in time
+# order) starting at `data_offset`, so a reader can memory-map them directly.
+
+MAGIC = b"CITYTRJ1"
+VERSION = 1
+ALIGNMENT = 64
+
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("walker", "<u4"),        # int(walker.id)
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("street", "<i4"),
+    ("avenue", "<i4"),
+    ("corner", "i1"),         # corner code, see CORNER_CODES
+    ("target_street", "<i4"),
+    ("target_avenue", "<i4"),
+    ("target_corner", "i1"),
+])
+
+_GRID_FIELDS = (
+    "num_streets", "num_avenues",
+    "street_block_length", "street_crosswalk_length",
+    "avenue_block_length", "avenue_crosswalk_length",
+    "avenue_traffic_light_cycle_times", "traffic_light_grid_random_seed", "run_id",
+)
+
+
+def _encode_header(grid: CityGrid) -> bytes:
+    offsets = np.ascontiguousarray(grid.traffic_light_offsets, dtype="<f8")
+    header = {
+        "version": VERSION,
+        "grid": {field: getattr(grid, field) for field in _GRID_FIELDS},
+        "record_dtype": RECORD_DTYPE.descr,
+        "offsets_shape": list(offsets.shape),
+    }
+    # Lay out header, then 8-byte aligned offsets, then ALIGNMENT-aligned records.
+    # The layout fields are part of the header, so repeat until their values are stable.
+    header["offsets_offset"] = header["data_offset"] = 0
+    while True:
+        encoded = json.dumps(header).encode()
+        offsets_start = _align(len(MAGIC) + 4 + len(encoded), 8)
+        data_start = _align(offsets_start + offsets.nbytes, ALIGNMENT)
+        if (offsets_start, data_start) == (header["offsets_offset"], header["data_offset"]):
+            break
+        header["offsets_offset"], header["data_offset"] = offsets_start, data_start
+
+    out = bytearray(data_start)
+    out[:len(MAGIC)] = MAGIC
+    out[len(MAGIC):len(MAGIC) + 4] = struct.pack("<I", len(encoded))
+    out[len(MAGIC) + 4:len(MAGIC) + 4 + len(encoded)] = encoded
+    out[offsets_start:offsets_start + offsets.nbytes] = offsets.tobytes()
+    return bytes(out)
+
+
+def _align(n: int, alignment: int) -> int:
+    return -(-n // alignment) * alignment
+
+
+# ------------------- Writer -------------------
+
+class TrajectoryWriter:
+    """
+    Streams walker trajectories to a binary file. Frames are packed into fixed-size
+    chunks of RECORD_DTYPE rows on the simulation thread, and full chunks are handed
+    to a background thread through a bounded queue, so the simulation only ever
+    waits on disk I/O if it gets `queue_size` chunks ahead of it.
+
+        with TrajectoryWriter("run.traj", grid) as writer:
+            writer.write_walkers(sim.time, sim.walkers)
+    """
+    def __init__(self, path: str, grid: CityGrid, chunk_size: int = 1 << 16, queue_size: int = 8):
+        self.path = path
+        self.grid = grid
+        self.chunk_size = chunk_size
+        self.records_written = 0
+
+        self._chunk = np.empty(chunk_size, dtype=RECORD_DTYPE)
+        self._filled = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._file = open(path, "wb")
+        self._file.write(_encode_header(grid))
+        self._thread = threading.Thread(target=self._drain, name="trajectory-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _drain(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            try:
+                self._file.write(chunk.tobytes())
+            except Exception as e:
+                self._error = e
+
+    def write(self, time: float, walker, x, y, street, avenue, corner, target_street, target_avenue, target_corner):
+        """Appends one frame; every argument except `time` is an array with one entry per walker"""
+        if self._error is not None:
+            raise self._error
+        n = len(walker)
+        columns = (("walker", walker), ("x", x), ("y", y), ("street", street), ("avenue", avenue), ("corner", corner),
+                   ("target_street", target_street), ("target_avenue", target_avenue), ("target_corner", target_corner))
+        start = 0
+        while start < n:
+            count = min(n - start, self.chunk_size - self._filled)
+            rows = self._chunk[self._filled:self._filled + count]
+            rows["time"] = time
+            for name, values in columns:
+                rows[name] = values[start:start + count]
+            self._filled += count
+            start += count
+            if self._filled == self.chunk_size:
+                self._flush_chunk()
+        self.records_written += n
+
+    @profiled("output.trajectory")
+    def write_walkers(self, time: float, walkers: List[Walker]):
+        """Appends one frame of `Walker` objects"""
+        street = np.fromiter((w.street_idx for w in walkers), dtype=np.int32, count=len(walkers))
+        avenue = np.fromiter((w.avenue_idx for w in walkers), dtype=np.int32, count=len(walkers))
+        corner = np.fromiter((w.corner_code for w in walkers), dtype=np.int8, count=len(walkers))
+        target_street = np.fromiter((w.target_street_idx for w in walkers), dtype=np.int32, count=len(walkers))
+        target_avenue = np.fromiter((w.target_avenue_idx for w in walkers), dtype=np.int32, count=len(walkers))
+        target_corner = np.fromiter((w.target_corner_code for w in walkers), dtype=np.int8, count=len(walkers))
+        progress = np.fromiter((w.progress for w in walkers), dtype=np.float64, count=len(walkers))
+        xy = self.grid.segment_xy(street, avenue, corner, target_street, target_avenue, target_corner, progress)
+        walker_ids = np.fromiter((int(w.id) for w in walkers), dtype=np.uint32, count=len(walkers))
+        self.write(time, walker_ids, xy[:, 0], xy[:, 1], street, avenue, corner, target_street, target_avenue, target_corner)
+
+    @profiled("output.trajectory")
+    def write_batch(self, time: float, batch: WalkerBatch):
+        """Appends one frame of a `WalkerBatch`, walker ids are the batch indices"""
+        xy = batch.positions()
+        self.write(time, np.arange(len(batch), dtype=np.uint32), xy[:, 0], xy[:, 1],
+                   batch.street_idx, batch.avenue_idx, batch.corner,
+                   batch.target_street_idx, batch.target_avenue_idx, batch.target_corner)
+
+    def _flush_chunk(self):
+        # Hand the full chunk to the writer thread and start filling a fresh one
+        self._queue.put(self._chunk[:self._filled])
+        self._chunk = np.empty(self.chunk_size, dtype=RECORD_DTYPE)
+        self._filled = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._filled:
+            self._flush_chunk()
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+# ------------------- Reader -------------------
+
+def read_header(path: str) -> dict:
+    """Reads only the JSON header of a trajectory file"""
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        (header_length,) = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(header_length))
+    if header["version"] != VERSION:
+        raise ValueError(f"Unsupported trajectory file version {header['version']}")
+    return header
+
+
+class TrajectoryReader:
+    """
+    Memory-mapped view of a file written by `TrajectoryWriter`. Nothing but the header
+    and the light offsets is read up front; frames are located by binary search on the
+    time column, so seeking only touches the pages it needs, however large the file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.header = read_header(path)
+        offsets_shape = tuple(self.header["offsets_shape"])
+        self.traffic_light_offsets = np.fromfile(
+            path, dtype="<f8", count=int(np.prod(offsets_shape)), offset=self.header["offsets_offset"]
+        ).reshape(offsets_shape)
+
+        data_offset = self.header["data_offset"]
+        num_records = (os.path.getsize(path) - data_offset) // RECORD_DTYPE.itemsize
+        if num_records:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=data_offset, shape=(num_records,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self._times = self.records["time"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def grid(self) -> CityGrid:
+        """The recorded grid, with the recorded light offsets"""
+        params = dict(self.header["grid"])
+        params["avenue_traffic_light_cycle_times"] = tuple(params["avenue_traffic_light_cycle_times"])
+        return CityGrid(**params, traffic_light_offsets=self.traffic_light_offsets)
+
+    @property
+    def start_time(self) -> float:
+        return float(self._times[0]) if len(self) else 0.0
+
+    @property
+    def end_time(self) -> float:
+        return float(self._times[-1]) if len(self) else 0.0
+
+    def frame_at(self, time: float) -> np.ndarray:
+        """Records of the last frame at or before `time` (the first frame if `time` is earlier)"""
+        if not len(self):
+            return self.records
+        # bisect reads single elements of the strided time column, np.searchsorted would copy all of it
+        end = max(bisect.bisect_right(self._times, time), 1)
+        frame_time = self._times[end - 1]
+        start = bisect.bisect_left(self._times, frame_time)
+        end = bisect.bisect_right(self._times, frame_time, lo=end - 1)
+        return self.records[start:end]
+
+    def state_at(self, time: float) -> SimulationState:
+        """The frame at `time` in the form `Visualizer.draw` expects"""
+        frame = np.asarray(self.frame_at(time))
+        walkers = [
+            {
+                "id": str(walker),
+                "x": x,
+                "y": y,
+                "corner": CORNERS[corner],
+                "start": (street, avenue, CORNERS[corner]),
+                "end": (target_street, target_avenue, CORNERS[target_corner]),
+                "destination": None,
+            }
+            for _, walker, x, y, street, avenue, corner, target_street, target_avenue, target_corner in frame.tolist()
+        ]
+        return SimulationState(time=float(frame["time"][0]) if len(frame) else 0.0, walkers=walkers)
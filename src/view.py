@@ -1,8 +1,16 @@
 import math
+from os import environ
+from typing import List
 
+# Suppresses the message: 'Hello from the pygame community.' on startup
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import numpy as np
 import pygame
 
-from src.model import CityGrid, SimulationState
+from src.model import CityGrid, CitySimulation, SimulationState
+from src.profiling import profiled, span
+from src.trajectory import TrajectoryReader
 
 # COLORS
 BLACK = (0, 0, 0)
@@ -91,6 +99,10 @@ class Viewport:
         sy = int((y / self.world_height) * self.screen_height)
         return sx, sy
 
+    def to_screen_array(self, xy):
+        """Vectorized `to_screen` for an array of (..., 2) world coordinates, returned as nested lists"""
+        return ((xy / np.array([self.world_width, self.world_height])) * np.array([self.screen_width, self.screen_height])).astype(int).tolist()
+
 def draw_grid(scrn, grid: CityGrid, viewport, color=BLACK):
 
     # Avenues (vertical lines)
@@ -128,37 +140,86 @@ def draw_grid(scrn, grid: CityGrid, viewport, color=BLACK):
 
 
 class Visualizer:
+    """
+    Draws simulation states onto the screen. The static city is rendered once into a
+    cached scene surface that also holds the current traffic lights; every frame only
+    the lights whose phase changed and the walker sprites are redrawn, and `draw`
+    returns those screen areas for `pygame.display.update`.
+    """
+    traffic_light_length = 12
+    traffic_light_width = 6
+
     def __init__(self, scrn, viewport):
         self.screen = scrn
         self.viewport = viewport
-
-    def draw(self, state: SimulationState, grid: CityGrid):
-        self.screen.fill(WHITE)
-
-        traffic_light_length = 12
-        traffic_light_width = 6
-
-        # Draw streets/avenues normally
-        draw_grid(self.screen, grid, self.viewport)
-
-        # Traffic light animations
-        for intersection_tuple, offset_time in grid.traffic_light_grid.items():
-            avenue_light_color = GREEN if (state.time + offset_time) % grid.traffic_light_cycle_length > grid.avenue_traffic_light_cycle_times[0] else RED
-            street_light_color = RED if avenue_light_color == GREEN else GREEN
-            intersection_x, intersection_y = grid.intersection_xy(*intersection_tuple)
-            tx, ty = self.viewport.to_screen(intersection_x, intersection_y)
-            pygame.draw.rect(self.screen, avenue_light_color, (tx - (traffic_light_length / 2), ty - (traffic_light_width / 2), traffic_light_length, traffic_light_width))
-            pygame.draw.rect(self.screen, street_light_color, (tx - (traffic_light_width / 2), ty - (traffic_light_length / 2), traffic_light_width, traffic_light_length))
+        self._grid = None
+        self._scene = None
+        self._intersection_screen_xy = None
+        self._avenue_lights_are_green = None
+        self._walker_rects = []
+
+    def _build_scene(self, grid: CityGrid):
+        # Draw streets/avenues once
+        self._scene = pygame.Surface(self.screen.get_size()).convert()
+        self._scene.fill(WHITE)
+        draw_grid(self._scene, grid, self.viewport)
+        self._grid = grid
+        self._intersection_screen_xy = self.viewport.to_screen_array(grid.intersection_coordinates)
+        self._avenue_lights_are_green = None
+        self._walker_rects = []
+
+    def _draw_light(self, avenue_idx: int, street_idx: int, avenue_light_is_green: bool) -> pygame.Rect:
+        avenue_light_color = GREEN if avenue_light_is_green else RED
+        street_light_color = RED if avenue_light_is_green else GREEN
+        tx, ty = self._intersection_screen_xy[avenue_idx][street_idx]
+        length, width = self.traffic_light_length, self.traffic_light_width
+        avenue_rect = pygame.draw.rect(self._scene, avenue_light_color, (tx - (length / 2), ty - (width / 2), length, width))
+        street_rect = pygame.draw.rect(self._scene, street_light_color, (tx - (width / 2), ty - (length / 2), width, length))
+        return avenue_rect.union(street_rect)
+
+    @profiled("view.draw")
+    def draw(self, state: SimulationState, grid: CityGrid) -> List[pygame.Rect]:
+        """
+        Draws the state and returns the areas of the screen that changed.
+        """
+        full_redraw = grid is not self._grid
+        if full_redraw:
+            self._build_scene(grid)
+        dirty = []
+
+        # Erase last frame's walkers
+        for rect in self._walker_rects:
+            self.screen.blit(self._scene, rect, rect)
+        dirty.extend(self._walker_rects)
+
+        # Traffic light animations, only for the lights that changed
+        avenue_lights_are_green = grid.avenue_lights_are_green(state.time)
+        if self._avenue_lights_are_green is None:
+            changed = np.argwhere(np.ones_like(avenue_lights_are_green))
+        else:
+            changed = np.argwhere(avenue_lights_are_green != self._avenue_lights_are_green)
+        self._avenue_lights_are_green = avenue_lights_are_green
+        for avenue_idx, street_idx in changed.tolist():
+            rect = self._draw_light(avenue_idx, street_idx, bool(avenue_lights_are_green[avenue_idx, street_idx]))
+            if not full_redraw:
+                self.screen.blit(self._scene, rect, rect)
+                dirty.append(rect)
+
+        if full_redraw:
+            self.screen.blit(self._scene, (0, 0))
+            dirty = [self.screen.get_rect()]
 
         # Highlight walker segments (corner-to-corner)
+        walker_rects = []
         for w in state.walkers:
 
-            # X-mark the destination corner for each walker
-            dj, di, dc = w["destination"]
-            xd, yd = grid.corner_xy(dj, di, dc)
-            sxd, syd = self.viewport.to_screen(xd, yd)
-            pygame.draw.line(self.screen, RED, (sxd - 5, syd - 5), (sxd + 5, syd + 5), 5)
-            pygame.draw.line(self.screen, RED, (sxd + 5, syd - 5), (sxd - 5, syd + 5), 5)
+            # X-mark the destination corner for each walker (not known for replayed walkers)
+            if w["destination"] is not None:
+                dj, di, dc = w["destination"]
+                xd, yd = grid.corner_xy(dj, di, dc)
+                sxd, syd = self.viewport.to_screen(xd, yd)
+                walker_rects.append(pygame.draw.line(self.screen, RED, (sxd - 5, syd - 5), (sxd + 5, syd + 5), 5))
+                walker_rects.append(pygame.draw.line(self.screen, RED, (sxd + 5, syd - 5), (sxd - 5, syd + 5), 5))
 
             # Get segment start and end coordinates
             j0, i0, c0 = w["start"]
@@ -168,11 +229,136 @@ class Visualizer:
             sx0, sy0 = self.viewport.to_screen(x0, y0)
             sx1, sy1 = self.viewport.to_screen(x1, y1)
 
-            walker_color = WALKER_COLOR_LIST[int(w["id"])]
+            walker_idx = int(w["id"])
+            walker_color = WALKER_COLOR_LIST[walker_idx % len(WALKER_COLOR_LIST)]
 
             # Draw segment in red
-            pygame.draw.line(self.screen, (255, 0, 0), (sx0, sy0), (sx1, sy1), 4)
+            walker_rects.append(pygame.draw.line(self.screen, (255, 0, 0), (sx0, sy0), (sx1, sy1), 4))
 
             # Draw walkers on top of segments
             px, py = self.viewport.to_screen(w["x"], w["y"])
-            pygame.draw.circle(self.screen, walker_color, (px, py), 8 - int(w["id"]))
\ No newline at end of file
+            walker_rects.append(pygame.draw.circle(self.screen, walker_color, (px, py), max(8 - walker_idx, 3)))
+
+        # Pad by a pixel for the ends of thick lines
+        self._walker_rects = [rect.inflate(2, 2) for rect in walker_rects]
+        dirty.extend(self._walker_rects)
+        return dirty
+
+
+# Longest real frame time fed into the simulation, so a stall doesn't trigger a burst of catch-up steps
+MAX_FRAME_TIME = 0.25
+
+
+def interpolate_state(state: SimulationState, previous_xy: List[tuple[float, float]], alpha: float, dt: float) -> SimulationState:
+    """
+    Blends walker positions of `state` with their positions one step (dt) earlier.
+    :param alpha: 0.0 gives the previous positions, 1.0 the positions in `state`
+    """
+    if len(previous_xy) == len(state.walkers):
+        for w, (x0, y0) in zip(state.walkers, previous_xy):
+            w["x"] = x0 + (w["x"] - x0) * alpha
+            w["y"] = y0 + (w["y"] - y0) * alpha
+    return SimulationState(time=state.time - (1 - alpha) * dt, walkers=state.walkers)
+
+
+def run_pygame(cfg, sim: CitySimulation):
+    """
+    Runs the simulation with a fixed model step of 1 / `cfg.frame_rate`, decoupled from
+    drawing: every frame the model advances by as many steps as the elapsed real time
+    times `cfg.time_scale` allows, and walkers are drawn interpolated between the last
+    two steps. With `cfg.max_speed` the model runs flat out and only every
+    `cfg.render_every`-th step is drawn.
+    """
+    grid = sim.grid
+    dt = 1 / cfg.frame_rate
+
+    # Setup Pygame
+    pygame.init()
+    screen = pygame.display.set_mode((cfg.screen_width, cfg.screen_height))
+    pygame.display.set_caption("City Simulation")
+    viewport = Viewport(grid.width, grid.height, cfg.screen_width, cfg.screen_height)
+    vis = Visualizer(screen, viewport)
+    clock = pygame.time.Clock()
+
+    accumulator = 0.0
+    previous_xy = [(w["x"], w["y"]) for w in sim.snapshot().walkers]
+    running = True
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        if cfg.max_speed:
+            for _ in range(cfg.render_every):
+                sim.step(dt, snapshot=False)
+            dirty = vis.draw(sim.snapshot(), grid)
+            with span("view.display"):
+                pygame.display.update(dirty)
+            clock.tick()
+            continue
+
+        accumulator += min(clock.tick(cfg.display_rate) / 1000, MAX_FRAME_TIME) * cfg.time_scale
+        steps = int(accumulator // dt)
+        accumulator -= steps * dt
+        if steps:
+            for _ in range(steps - 1):
+                sim.step(dt, snapshot=False)
+            previous_xy = [(w["x"], w["y"]) for w in sim.snapshot().walkers]
+            sim.step(dt, snapshot=False)
+
+        state = interpolate_state(sim.snapshot(), previous_xy, accumulator / dt, dt)
+        dirty = vis.draw(state, grid)
+        with span("view.display"):
+            pygame.display.update(dirty)
+
+    pygame.quit()
+
+
+def run_replay(cfg, reader: TrajectoryReader):
+    """
+    Plays back a recorded trajectory without running the model.
+    Controls: SPACE pause, LEFT / RIGHT seek 10s, UP / DOWN double / halve playback speed, HOME restart
+    """
+    grid = reader.grid()
+
+    pygame.init()
+    screen = pygame.display.set_mode((cfg.screen_width, cfg.screen_height))
+    pygame.display.set_caption(f"City Simulation - replay of {reader.path}")
+    viewport = Viewport(grid.width, grid.height, cfg.screen_width, cfg.screen_height)
+    vis = Visualizer(screen, viewport)
+    clock = pygame.time.Clock()
+
+    playback_time = reader.start_time
+    playback_speed = 1.0
+    paused = False
+    running = True
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_RIGHT:
+                    playback_time += 10.0
+                elif event.key == pygame.K_LEFT:
+                    playback_time -= 10.0
+                elif event.key == pygame.K_UP:
+                    playback_speed *= 2.0
+                elif event.key == pygame.K_DOWN:
+                    playback_speed /= 2.0
+                elif event.key == pygame.K_HOME:
+                    playback_time = reader.start_time
+
+        real_dt = clock.tick(cfg.display_rate) / 1000
+        if not paused:
+            playback_time += real_dt * playback_speed
+        playback_time = min(max(playback_time, reader.start_time), reader.end_time)
+
+        dirty = vis.draw(reader.state_at(playback_time), grid)
+        with span("view.display"):
+            pygame.display.update(dirty)
+
+    pygame.quit()